@@ -1,26 +1,40 @@
 #!/usr/bin/env python3
 from flask import (Flask, request, jsonify, render_template, send_file, abort,
-                   session, g, make_response, Response)
+                   session, g, make_response, Response, stream_with_context)
 from werkzeug.middleware.proxy_fix import ProxyFix
+from urllib.parse import quote
 from datetime import datetime
 import time
 import os
 import sys
 import random
+import io
+import re
 import json
 import secrets
-import TSVZ
+import threading
+import mimetypes
+import zlib
+import shutil
+import tempfile
+from contextlib import nullcontext
 #import imghdr
 import filetype
 
-from boards import (Boards, BoardState, RateLimiter, canonical_slug, can,
+from storage import open_table, BACKENDS
+from uploads import iter_parts, write_part, FilePart, ChunkedUploads, OverBudget, SNIFF_SIZE
+from blobs import BlobStore, file_digest
+from archive import write_archive, read_archive
+from trash import Trash, DiscardQueue
+from thumbs import Thumbnailer
+from boards import (Boards, BoardState, RateLimiter, TextCache, Reaper, SharedClocks, DiskUsage,
+                    file_lock, canonical_slug, can, INDEX_HEADER,
                     new_secret, verify_code, provisioning_uri,
                     PERMS, DEFAULT_PERM, PUBLIC_PERM)
 
 version = '1.6.0'
 
 #TODO: add feature: copy from the webpage should be easier : ctrl c copy the last message , add a copy to clipboard button to messages
-#TODO: add periodic update / event based update to the webpage
 
 # print with flush on
 from functools import partial
@@ -37,13 +51,41 @@ print = partial(print, flush=True)
 DEFAULT_CONFIG = {
     'BASE_DIR': 'messages/',                        # where default-board files live
     'INDEX_FILE': 'mainIndex.tsv',                  # TSVZ-backed default-board index
+    'INDEX_BACKEND': 'tsvz',                        # 'tsvz' or 'sqlite' (auto-imports existing .tsv/.nsv)
     'INDEX_REWRITE_INTERVAL': 3600 * 20,            # TSVZ compaction interval (s)
     'RETENTION_SIZE': '100MB',                       # hard-delete files larger than this
     'RETENTION_TIME': '4h',                          # purge entries older than this (0 = never)
+    'REAPER_BATCH': 500,                             # expired messages purged per batch
+    'DELETED_GRACE': '7d',                           # hard-delete .deleted files after this (0 = never by age)
+    'DELETED_BUDGET': 0,                             # max bytes of .deleted files kept, oldest go first (0 = no cap)
+    'DELETED_SWEEP_RATE': 20,                        # max .deleted files removed per second (0 = unthrottled)
     'MAX_CONTENT_LENGTH': '16GB',                    # max accepted upload size
+    'BOARD_QUOTA': 0,                                # max bytes stored per board (0 = no quota)
+    'DISK_QUOTA': 0,                                 # max bytes stored by all boards together (0 = no quota)
+    'UPLOADS_DIR': 'uploads/',                      # partial resumable (chunked) uploads
+    'UPLOAD_CHUNK_SIZE': '8MB',                      # chunk size of resumable uploads
+    'UPLOAD_EXPIRY': '24h',                          # drop partial uploads idle this long
+    'BLOB_STORE': False,                             # dedup identical uploads via hard-linked blobs
+    'BLOBS_DIR': 'blobs/',                           # content-addressed blobs (same filesystem as boards)
+    'TEXT_CACHE_SIZE': '64MB',                       # in-memory budget for text message bodies
+    'TEXT_INLINE_LIMIT': '64KB',                     # longer pastes are listed as a preview (full at /text/<id>)
+    'THUMBNAILS': True,                              # downscaled previews for listings (needs Pillow; ffmpeg for videos)
+    'THUMBNAIL_SIZE': 480,                           # longest side of a thumbnail, in pixels
+    'THUMBNAIL_WORKERS': 2,                          # background threads making thumbnails
+    'SENDFILE': '',                                  # '', 'x-accel-redirect' (nginx) or 'x-sendfile'
+    'X_ACCEL_PREFIX': '/_wpaste_files/',             # nginx internal location mapped to X_ACCEL_ROOT
+    'X_ACCEL_ROOT': '.',                             # directory that location aliases
     'HOST': '127.0.0.1',                             # dev server bind host
     'PORT': 5000,                                    # dev server bind port
     'DEBUG': True,                                    # dev server debug mode
+    'CHANGELOG_SIZE': 1024,                           # per-board change log kept for /messages?since=
+    'LONGPOLL_TIMEOUT': '25s',                        # max time a /last-update?since= request is parked
+    'COMPRESS_LEVEL': 6,                              # gzip/deflate level for JSON and plaintext (0 = off)
+    'LONGPOLL_MAX_WAITERS': 8,                        # parked long-polls at once (0 = plain polling only)
+    'MAX_OPEN_BOARDS': 256,                           # named boards kept open at once (LRU)
+    'BOARD_IDLE_TIME': '10m',                         # close a board's index unused this long (0 = never)
+    'MULTI_WORKER': False,                            # share clocks/indexes across gunicorn workers
+    'SHARED_CLOCKS_FILE': '.wpaste_clocks',           # memory-mapped clock table (MULTI_WORKER only)
     # --- private boards ---
     'BOARDS_DIR': 'boards/',                          # per-board indexes + files
     'REGISTRY_FILE': 'boards.nsv',                    # TSVZ board registry (null-separated)
@@ -109,10 +151,38 @@ def load_config():
 _config = load_config()
 BASE_DIR = _config['BASE_DIR']
 INDEX_FILE = _config['INDEX_FILE']
+INDEX_BACKEND = _config['INDEX_BACKEND']
 INDEX_REWRITE_INTERVAL = int(_config['INDEX_REWRITE_INTERVAL'])
+CHANGELOG_SIZE = int(_config['CHANGELOG_SIZE'])
+LONGPOLL_TIMEOUT = parse_duration(_config['LONGPOLL_TIMEOUT'])
+LONGPOLL_MAX_WAITERS = int(_config['LONGPOLL_MAX_WAITERS'])
+MAX_OPEN_BOARDS = int(_config['MAX_OPEN_BOARDS'])
+BOARD_IDLE_TIME = parse_duration(_config['BOARD_IDLE_TIME'])
+MULTI_WORKER = bool(_config['MULTI_WORKER'])
+SHARED_CLOCKS_FILE = _config['SHARED_CLOCKS_FILE']
 RETENTION_SIZE = parse_size(_config['RETENTION_SIZE'])  # hard-delete files bigger than this
 RETENTION_TIME = parse_duration(_config['RETENTION_TIME'])  # purge entries older than this (0 = never)
+REAPER_BATCH = int(_config['REAPER_BATCH'])
+DELETED_GRACE = parse_duration(_config['DELETED_GRACE'])
+DELETED_BUDGET = parse_size(_config['DELETED_BUDGET'])
+DELETED_SWEEP_RATE = float(_config['DELETED_SWEEP_RATE'])
 MAX_CONTENT_LENGTH = parse_size(_config['MAX_CONTENT_LENGTH'])
+BOARD_QUOTA = parse_size(_config['BOARD_QUOTA'])
+DISK_QUOTA = parse_size(_config['DISK_QUOTA'])
+UPLOADS_DIR = _config['UPLOADS_DIR']
+UPLOAD_CHUNK_SIZE = parse_size(_config['UPLOAD_CHUNK_SIZE'])
+UPLOAD_EXPIRY = parse_duration(_config['UPLOAD_EXPIRY'])
+BLOB_STORE = bool(_config['BLOB_STORE'])
+BLOBS_DIR = _config['BLOBS_DIR']
+TEXT_CACHE_SIZE = parse_size(_config['TEXT_CACHE_SIZE'])
+TEXT_INLINE_LIMIT = parse_size(_config['TEXT_INLINE_LIMIT'])
+COMPRESS_LEVEL = int(_config['COMPRESS_LEVEL'])
+THUMBNAILS = bool(_config['THUMBNAILS'])
+THUMBNAIL_SIZE = int(_config['THUMBNAIL_SIZE'])
+THUMBNAIL_WORKERS = int(_config['THUMBNAIL_WORKERS'])
+SENDFILE = (_config['SENDFILE'] or '').lower()
+X_ACCEL_PREFIX = '/' + _config['X_ACCEL_PREFIX'].strip('/') + '/'
+X_ACCEL_ROOT = os.path.abspath(_config['X_ACCEL_ROOT'])
 BOARDS_DIR = _config['BOARDS_DIR']
 REGISTRY_FILE = _config['REGISTRY_FILE']
 MAX_SESSIONS = int(_config['MAX_SESSIONS'])
@@ -169,19 +239,22 @@ def resolve_secret_key(config):
     if sk:
         return sk
     secret_path = '.wpaste_secret'
-    existing = _load_existing_secret(secret_path)
-    if existing:
-        return existing
-    sk = secrets.token_urlsafe(48)
-    try:
-        _persist_secret(secret_path, sk)
-    except OSError as e:
-        print(f"Warning: could not persist SECRET_KEY to {secret_path}: {e}")
-    return sk
+    # Locked so that workers starting together agree on one generated key.
+    with file_lock(f'{secret_path}.lock'):
+        existing = _load_existing_secret(secret_path)
+        if existing:
+            return existing
+        sk = secrets.token_urlsafe(48)
+        try:
+            _persist_secret(secret_path, sk)
+        except OSError as e:
+            print(f"Warning: could not persist SECRET_KEY to {secret_path}: {e}")
+        return sk
 
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['USE_X_SENDFILE'] = SENDFILE == 'x-sendfile'
 app.config['SECRET_KEY'] = resolve_secret_key(_config)
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
@@ -207,9 +280,8 @@ def generate_random_id(index, length=8):
     return randStr
 
 # Function to validate if file is an image
-def validate_image(stream):
-    header = stream.read(512)  # 512 bytes should be enough for a header check
-    stream.seek(0)  # Reset stream pointer
+def validate_image(header):
+    # header: the first SNIFF_SIZE (512) bytes, enough for a header check.
     # imghdr had been deprecated, use filetype instead
     kind = filetype.guess(header)
     if kind is not None and kind.mime.startswith('image/'):
@@ -220,33 +292,80 @@ def validate_image(stream):
         return 'jxl'
     return None
 
+def detect_mime(header, filename):
+    '''The MIME type recorded for a file: sniffed from its first bytes, else
+    guessed from its name the way send_file would.'''
+    kind = filetype.guess(header)
+    if kind is not None:
+        return kind.mime
+    if validate_image(header) == 'jxl':
+        return 'image/jxl'
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
 def delete_file_on_disk(index, message_id):
     '''Soft-delete (rename to <path>.deleted) unless the file exceeds
-    RETENTION_SIZE, in which case hard-delete. Mirrors the original behavior.'''
+    RETENTION_SIZE, in which case hard-delete. Mirrors the original behavior.
+    Soft-deleted files are handed to the trash sweeper; a thumbnail just goes.'''
     if message_id not in index:
         print(f"Message {message_id} not found in index.")
         return
-    old_file_path = index[message_id][2]
+    row = index[message_id]
+    discard_file(row[2], _row_digest(row))
+    print(f"Message {message_id} deleted successfully.")
+
+def discard_file(old_file_path, digest=''):
+    '''delete_file_on_disk for a path (and the sha256 its row recorded) whose
+    index row is already gone.'''
     new_file_path = f"{old_file_path}.deleted"
     if os.path.exists(old_file_path):
-        if os.path.getsize(old_file_path) > RETENTION_SIZE:
+        if blob_store is not None and os.stat(old_file_path).st_nlink > 1:
+            # A reference into the blob store: drop it, and the blob with it
+            # if this was the last. Rows from before the sha256 column are
+            # hashed here.
+            digest = digest or file_digest(old_file_path)
             os.remove(old_file_path)
+            blob_store.release(digest)
         else:
-            os.rename(old_file_path, new_file_path)
+            size = os.path.getsize(old_file_path)
+            if size > RETENTION_SIZE:
+                os.remove(old_file_path)
+            else:
+                os.rename(old_file_path, new_file_path)
+                trash.add(new_file_path, size)
     else:
         print(f"File not found: {old_file_path}")
-    print(f"Message {message_id} deleted successfully.")
+    # After the file: a thumbnail written meanwhile is then either removed
+    # here or by its worker, which checks that the file is still there.
+    try:
+        os.remove(Thumbnailer.path_of(old_file_path))
+    except OSError:
+        pass
 
+# Multi-worker mode: update clocks live in a file every worker maps, and index
+# writes are serialized with file locks (see SharedClocks / BoardState).
+shared_clocks = SharedClocks(SHARED_CLOCKS_FILE) if MULTI_WORKER else None
+
+# Bytes stored per board and in total, for /stats, `admin list` and quotas.
+disk_usage = DiskUsage()
 
 # Default/root board: the original global, public, unowned board.
-mainIndex = TSVZ.TSVZed(INDEX_FILE, header=['id', 'unix_time', 'path', 'type', 'filename'],
-                        rewrite_interval=INDEX_REWRITE_INTERVAL, verbose=False)
-default_board = BoardState(None, mainIndex, BASE_DIR)
+mainIndex = open_table(INDEX_FILE, INDEX_HEADER, backend=INDEX_BACKEND,
+                       rewrite_interval=INDEX_REWRITE_INTERVAL,
+                       lock_path=f'{INDEX_FILE}.lock' if MULTI_WORKER else None)
+default_board = BoardState(None, mainIndex, BASE_DIR, changelog_size=CHANGELOG_SIZE,
+                           clocks=shared_clocks, lock_path=f'{INDEX_FILE}.lock',
+                           usage=disk_usage)
 
 rate_limiter = RateLimiter()
+text_cache = TextCache(TEXT_CACHE_SIZE)
+# Each parked long-poll holds a server thread, so cap them well below the
+# thread pool (see gunicorn.conf.py); past the cap, requests answer at once.
+longpoll_slots = threading.BoundedSemaphore(LONGPOLL_MAX_WAITERS) if LONGPOLL_MAX_WAITERS > 0 else None
 boards = Boards(boards_dir=BOARDS_DIR, registry_file=REGISTRY_FILE,
                 max_sessions=MAX_SESSIONS, index_rewrite_interval=INDEX_REWRITE_INTERVAL,
-                rate_limiter=rate_limiter)
+                rate_limiter=rate_limiter, changelog_size=CHANGELOG_SIZE,
+                clocks=shared_clocks, index_backend=INDEX_BACKEND,
+                max_open=MAX_OPEN_BOARDS, idle_time=BOARD_IDLE_TIME, usage=disk_usage)
 
 
 # ---------------------------------------------------------------------------
@@ -319,6 +438,78 @@ def _deny(perm):
     '''Abort with a machine-readable 401 so the client knows to prompt for TOTP.'''
     abort(make_response(jsonify({'success': False, 'auth_required': True, 'perm': perm}), 401))
 
+def request_state(slug):
+    '''A named board's BoardState, pinned open until this request ends (the
+    pool must not close an index a request is still using).'''
+    state = boards.pin(slug)
+    g.setdefault('_pinned', []).append(state)
+    return state
+
+@app.teardown_request
+def _unpin_states(exc):
+    for state in g.pop('_pinned', ()):
+        boards.unpin(state)
+
+# JSON listings inline every text paste and plaintext dumps are all text, so
+# both are compressed for clients that accept it. Files (send_file, Range
+# requests, offloaded sends) are left alone.
+COMPRESS_MIMETYPES = ('application/json', 'text/plain')
+COMPRESS_MIN_SIZE = 1024              # smaller bodies go as they are
+COMPRESS_WBITS = {'gzip': 31, 'deflate': 15}
+
+@app.after_request
+def _compress(response):
+    if (not COMPRESS_LEVEL or response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = next((c for c in COMPRESS_WBITS if request.accept_encodings[c]), None)
+    if coding is None:
+        return response
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[coding])
+    if response.is_streamed:
+        response.response = _compressed(response.iter_encoded(), compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers['Content-Encoding'] = coding
+    etag, weak = response.get_etag()
+    if etag and not weak:             # the bytes differ from the identity encoding
+        response.set_etag(etag, weak=True)
+    return response
+
+def _compressed(chunks, compressor):
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def not_modified(tag):
+    '''A 304 if the client already holds the response tagged `tag`, else
+    None. Listings are tagged by the board's update clock, so a poll with
+    nothing new is answered before the index is touched.'''
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+        response.set_etag(tag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache, private'
+        return response
+    return None
+
+def tagged(response, tag):
+    '''Tag a listing so the browser revalidates it (If-None-Match) instead of
+    refetching it or caching it blindly.'''
+    response.set_etag(tag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache, private'
+    return response
+
 def resolve(slug, action):
     '''Resolve a board and enforce `action` permission. Returns
     (BoardState, perm, authed). Aborts 404/401 on failure.
@@ -328,34 +519,104 @@ def resolve(slug, action):
     if slug is None:
         if action == 'admin':
             abort(404)
+        default_board.refresh()
         return default_board, PUBLIC_PERM, False
     cslug = canonical_slug(slug)
-    if cslug is None or not boards.exists(cslug):
+    info = boards.lookup(cslug) if cslug is not None else None
+    if info is None:
         abort(404)
-    perm = boards.meta(cslug)['perm']
+    perm = info.perm
     authed = board_authed(cslug)
     if not can(perm, action, authed):
         _deny(perm)
-    return boards.state(cslug), perm, authed
+    state = request_state(cslug)
+    state.refresh()
+    return state, perm, authed
 
 def board_retention(slug):
     '''Resolve a board's retention (seconds; 0 = never purge).'''
     if slug is None:
         return RETENTION_TIME
-    m = boards.meta(slug)
-    if not m or m['retention'] in ('', None):
+    info = boards.lookup(slug)
+    if info is None or info.retention in ('', None):
         return RETENTION_TIME
     try:
-        return parse_duration(m['retention'])
+        return parse_duration(info.retention)
     except (ValueError, TypeError):
         return RETENTION_TIME
 
+def over_quota(state, incoming):
+    '''Why `incoming` more bytes may not be stored on the board (None if they
+    may): they would take it past BOARD_QUOTA, or every board together past
+    DISK_QUOTA. `incoming` may be None (length unknown): then only a board
+    already at its quota is refused, and the quota_budget() a write is given
+    stops the body once it has outgrown what is left.'''
+    incoming = incoming or 0
+    if BOARD_QUOTA and state.bytes + incoming > BOARD_QUOTA:
+        return f"Board is full: {state.bytes} of {BOARD_QUOTA} bytes used."
+    if DISK_QUOTA and disk_usage.total + incoming > DISK_QUOTA:
+        return "Storage is full."
+    return None
+
+def quota_budget(state):
+    '''Bytes the board may still take before over_quota() refuses them;
+    None if neither quota is set.'''
+    left = []
+    if BOARD_QUOTA:
+        left.append(BOARD_QUOTA - state.bytes)
+    if DISK_QUOTA:
+        left.append(DISK_QUOTA - disk_usage.total)
+    return max(0, min(left)) if left else None
+
+def over_budget(state, e):
+    '''The over_quota() message for a write stopped by OverBudget `e`.'''
+    return over_quota(state, e.budget + 1) or f"Storage is full: {e}."
+
+def read_text(state, message_id, file_path):
+    '''A text message's body, from the cache when possible.'''
+    key = (state.slug, message_id)
+    body = text_cache.get(key)
+    if body is None:
+        with open(file_path) as fh:
+            body = fh.read()
+        text_cache.put(key, body)
+    return body
+
+TEXT_PREVIEW_CHARS = 4096            # what a listing shows of a paste over TEXT_INLINE_LIMIT
+
+def text_preview(state, message_id, file_path):
+    '''The start of a long text message, without reading (or caching) all
+    of it.'''
+    body = text_cache.get((state.slug, message_id))
+    if body is not None:
+        return body[:TEXT_PREVIEW_CHARS]
+    with open(file_path) as fh:
+        return fh.read(TEXT_PREVIEW_CHARS)
+
 def _purge(state, message_id):
-    '''Internal delete used by lazy cleanup (no permission check).'''
-    if message_id in state.index:
-        delete_file_on_disk(state.index, message_id)
-        del state.index[message_id]
-        state.bump()
+    '''Internal delete used by the retention reaper (no permission check).'''
+    with state.mutating():
+        if message_id in state.index:
+            delete_file_on_disk(state.index, message_id)
+            del state.index[message_id]
+            text_cache.discard((state.slug, message_id))
+            state.bump('delete', message_id)
+
+def _reaper_state(slug):
+    if slug is None:
+        return nullcontext(default_board)
+    return boards.using(slug) if boards.exists(slug) else nullcontext(None)
+
+reaper = Reaper(retention_of=board_retention, state_of=_reaper_state, purge=_purge,
+                batch=REAPER_BATCH)
+chunked_uploads = ChunkedUploads(UPLOADS_DIR, chunk_size=UPLOAD_CHUNK_SIZE,
+                                 max_size=MAX_CONTENT_LENGTH, expiry=UPLOAD_EXPIRY)
+blob_store = BlobStore(BLOBS_DIR) if BLOB_STORE else None
+trash = Trash([BASE_DIR, BOARDS_DIR], grace=DELETED_GRACE, budget=DELETED_BUDGET,
+              rate=DELETED_SWEEP_RATE)
+# Files of rows dropped by delete_all / delete_many, deleted after the reply.
+discard_queue = DiscardQueue(discard_file)
+thumbnailer = Thumbnailer(size=THUMBNAIL_SIZE, workers=THUMBNAIL_WORKERS) if THUMBNAILS else None
 
 
 # ---------------------------------------------------------------------------
@@ -365,58 +626,98 @@ def wants_plaintext(req):
     ua = (req.headers.get('User-Agent') or '').lower()
     return any(tok in ua for tok in ('curl', 'wget', 'libcurl', 'httpie'))
 
+TIMELINE_PAGE = 200                   # ids fetched from a board's timeline at a time
+
+def plaintext(body, status=200):
+    return Response(body, status=status, mimetype='text/plain; charset=utf-8')
+
+def iter_text(state, message_id, file_path, strip=False, chunk_size=64 * 1024):
+    '''A text message's body in chunks: the cached copy if there is one, else
+    read from disk a chunk at a time rather than loaded whole. With `strip`,
+    trailing newlines are dropped.'''
+    body = text_cache.get((state.slug, message_id))
+    if body is not None:
+        yield body.rstrip('\n') if strip else body
+        return
+    pending = ''                      # newlines held back until more text follows
+    with open(file_path) as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), ''):
+            if not strip:
+                yield chunk
+                continue
+            kept = chunk.rstrip('\n')
+            if kept:
+                yield pending + kept
+                pending = chunk[len(kept):]
+            else:
+                pending += chunk
+
 def render_plaintext(slug):
-    '''Terminal-friendly board dump for curl/wget on the front page.'''
+    '''Terminal-friendly board dump for curl/wget on the front page, streamed
+    message by message, newest first. ?tail=N shows only the newest N,
+    ?since=<unix time> only what was posted after it, and ?raw=<id> sends just
+    that message: a text body verbatim, anything else as its file.'''
     base = request.host_url.rstrip('/')
     if slug is None:
         state, perm = default_board, PUBLIC_PERM
         title = 'wpaste — public board'
     else:
-        if not boards.exists(slug):
-            return (f"Board '{slug}' does not exist.\n"
-                    f"Create it: POST to {base}/b/{slug}/setup with a TOTP secret + code.\n")
-        m = boards.meta(slug)
-        perm = m['perm']
+        info = boards.lookup(slug)
+        if info is None:
+            return plaintext(f"Board '{slug}' does not exist.\n"
+                             f"Create it: POST to {base}/b/{slug}/setup with a TOTP secret + code.\n")
+        perm = info.perm
         if not can(perm, 'read', board_authed(slug)):
-            return (f"Board '{m['display']}' is private.\n"
-                    f"Read it: curl -H 'X-TOTP: <code>' {base}/b/{slug}\n")
-        state = boards.state(slug)
-        title = f"wpaste — board '{m['display']}' ({perm})"
-    prefix = f'/b/{slug}' if slug else ''
-    retention = board_retention(slug)
-    now = datetime.now().timestamp()
-    rows = []
-    for mid in list(state.index):
-        r = state.index[mid] if mid in state.index else None
-        if r is None:
-            continue
-        try:                              # skip blank/partial (tombstone) rows
-            unix_time = float(r[1])
-        except (ValueError, TypeError, IndexError):
-            continue
-        if retention and now - unix_time > retention:
-            continue
-        if not r[2] or not os.path.exists(r[2]):
-            continue
-        rows.append((unix_time, mid, r[2], r[3], r[4]))
-    rows.sort(reverse=True)
-
-    lines = [title, '=' * len(title)]
-    if not rows:
-        lines.append('(empty)')
-    for unix_time, mid, fpath, mtype, fname in rows:
-        ts = datetime.fromtimestamp(unix_time).strftime('%Y-%m-%d %H:%M:%S')
-        if mtype == 'text':
-            with open(fpath) as fh:
-                body = fh.read()
-            lines.append(f'[{ts}] {mid} text')
-            lines.append(body.rstrip('\n'))
-        else:
-            lines.append(f'[{ts}] {mid} {mtype}  {base}{prefix}/{mtype}/{mid}  ({fname})')
-        lines.append('-' * 60)
-    auth_hint = '' if slug is None else "  -H 'X-TOTP: <code>'"
-    lines += ['', f'post: curl -d "message=hello"{auth_hint} {base}{prefix}/message']
-    return '\n'.join(lines) + '\n'
+            return plaintext(f"Board '{info.display}' is private.\n"
+                             f"Read it: curl -H 'X-TOTP: <code>' {base}/b/{slug}\n")
+        state = request_state(slug)
+        title = f"wpaste — board '{info.display}' ({perm})"
+    try:
+        tail = _positive_int(request.args.get('tail'))
+        since = float(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return plaintext("Invalid query: tail is a message count, since a unix time.\n", 400)
+    state.refresh()
+    raw = request.args.get('raw')
+    if raw:
+        row = state.index[raw] if raw in state.index else None
+        if row is None or _row_time(row, board_retention(state.slug), time.time()) is None:
+            return plaintext(f"No message {raw}.\n", 404)
+        if row[3] == 'text':
+            return plaintext(stream_with_context(iter_text(state, raw, row[2])))
+        return serve_message(state, raw)
+    return plaintext(stream_with_context(_plaintext_dump(state, title, base, tail, since)))
+
+def _plaintext_dump(state, title, base, tail, since):
+    prefix = f'/b/{state.slug}' if state.slug else ''
+    retention = board_retention(state.slug)
+    now = time.time()
+    yield f"{title}\n{'=' * len(title)}\n"
+    shown, before = 0, None
+    while tail is None or shown < tail:
+        ids, before = state.page(before, min(tail - shown, TIMELINE_PAGE) if tail else TIMELINE_PAGE,
+                                 after=since)
+        for mid in ids:
+            row = state.index[mid] if mid in state.index else None
+            unix_time = _row_time(row, retention, now) if row is not None else None
+            if unix_time is None:         # tombstone, expired, or file gone
+                continue
+            ts = datetime.fromtimestamp(unix_time).strftime('%Y-%m-%d %H:%M:%S')
+            mtype = row[3]
+            if mtype == 'text':
+                yield f'[{ts}] {mid} text\n'
+                yield from iter_text(state, mid, row[2], strip=True)
+                yield '\n'
+            else:
+                yield f'[{ts}] {mid} {mtype}  {base}{prefix}/{mtype}/{mid}  ({row[4]})\n'
+            yield '-' * 60 + '\n'
+            shown += 1
+        if before is None:
+            break
+    if not shown:
+        yield '(empty)\n'
+    auth_hint = '' if state.slug is None else "  -H 'X-TOTP: <code>'"
+    yield f'\npost: curl -d "message=hello"{auth_hint} {base}{prefix}/message\n'
 
 
 # ---------------------------------------------------------------------------
@@ -429,137 +730,496 @@ def index(slug):
     if slug and cslug is None:
         abort(404)
     if wants_plaintext(request):
-        return Response(render_plaintext(cslug), mimetype='text/plain; charset=utf-8')
+        return render_plaintext(cslug)
     return render_template('index.html', board=(cslug or ''), version=version)
 
 @app.route('/favicon.ico')
 def favicon():
     return app.send_static_file('favicon.ico')
 
+@app.route('/stats')
+def stats():
+    '''Cache and storage counters for operators (no board data).'''
+    counters = {"text_cache": text_cache.stats(), "open_boards": boards.pool_stats(),
+                "disk_usage": dict(disk_usage.stats(), board_quota=BOARD_QUOTA, disk_quota=DISK_QUOTA)}
+    counters["trash"] = trash.stats()
+    counters["discard_queue"] = discard_queue.stats()
+    if thumbnailer is not None:
+        counters["thumbnails"] = thumbnailer.stats()
+    if blob_store is not None:
+        counters["blob_store"] = blob_store.stats()
+    return jsonify(counters)
+
 
 # ---------------------------------------------------------------------------
 # Routes — messages (default board: bare paths; named boards: /b/<slug>/...)
 # ---------------------------------------------------------------------------
+def add_message(state, file_id, file_path, msg_type, filename, mime, size, unix_time=None,
+                digest=''):
+    '''Record a saved file in the board's index and announce it. The MIME
+    type and byte size go in the row so serving and listing need no disk read;
+    the sha256 `digest`, so a delete can release the file's blob directly.
+    unix_time defaults to now (imports keep the original). Images and videos
+    are queued for a thumbnail.'''
+    if unix_time is None:
+        unix_time = datetime.now().timestamp()
+    with state.mutating():
+        state.index[file_id] = [str(unix_time), file_path, msg_type, filename,
+                                mime, str(size), digest]
+        state.bump('add', file_id)
+    if thumbnailer is not None:
+        thumbnailer.submit(file_path, msg_type)
+
+
+UPLOAD_FIELDS = ('image', 'video', 'file')   # file form fields; each is also the message type
+
+def today_dir(state):
+    '''The board's directory for files saved today, created on demand.'''
+    dir_path = os.path.join(state.base_dir, datetime.now().strftime("%Y-%m-%d"))
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    return dir_path
+
+def save_text(state, dir_path, message):
+    file_id = generate_random_id(state.index)
+    file_path = os.path.join(dir_path, f"{file_id}.txt")
+    with open(file_path, 'w') as file:
+        file.write(message)
+    # Cache what a read back would return: text-mode reads fold \r\n / \r.
+    text_cache.put((state.slug, file_id), io.StringIO(message, newline=None).read())
+    add_message(state, file_id, file_path, 'text', f"{file_id}.txt",
+                'text/plain', os.path.getsize(file_path))
+
+_SAFE_EXTENSION = re.compile(r'^\.[A-Za-z0-9]{1,16}$')
+# Suffixes of files wpaste manages beside the messages' own (trash, blob links).
+RESERVED_EXTENSIONS = ('.deleted', '.link', '.lock')
+
+def file_extension(filename):
+    '''The extension a stored file takes from a client-supplied name: short
+    and alphanumeric, and never one wpaste gives its own files; else ''.'''
+    extension = os.path.splitext(filename or '')[1]
+    if not _SAFE_EXTENSION.match(extension) or extension.lower() in RESERVED_EXTENSIONS:
+        return ''
+    return extension
+
+def upload_path(dir_path, file_id, msg_type, filename, head):
+    '''Where an uploaded file goes, judged from its name and first bytes;
+    None if it is not acceptable as `msg_type`.'''
+    if msg_type == 'image':
+        extension = validate_image(head)
+        return os.path.join(dir_path, f"{file_id}.{extension}") if extension else None
+    extension = file_extension(filename)
+    if msg_type == 'video' and not extension:
+        return None
+    return os.path.join(dir_path, f"{file_id}{extension}")
+
+def save_upload(state, dir_path, msg_type, part):
+    '''Stream one uploaded file into dir_path and index it. Returns an error
+    message if the part is refused, else None.'''
+    file_id = generate_random_id(state.index)
+    sniffed = {}
+
+    def choose_path(head):
+        sniffed['mime'] = detect_mime(head, part.filename)
+        return upload_path(dir_path, file_id, msg_type, part.filename, head)
+
+    saved = write_part(part, choose_path, budget=quota_budget(state))
+    if saved is None:
+        return f"Invalid {msg_type} file: {part.filename}"
+    file_path, size, digest = saved
+    duplicate = blob_store is not None and blob_store.intern(file_path, digest)
+    print(f"{msg_type.capitalize()} saved to {file_path} ({size} bytes, sha256 {digest}"
+          f"{', duplicate' if duplicate else ''})")
+    add_message(state, file_id, file_path, msg_type, part.filename, sniffed['mime'], size,
+                digest=digest)
+    return None
+
+
 @app.route('/message', methods=['POST'], defaults={'slug': None})
 @app.route('/b/<slug>/message', methods=['POST'])
 def post_message(slug):
     state, perm, authed = resolve(slug, 'post')
-    index = state.index
-    today = datetime.now().strftime("%Y-%m-%d")
-    dir_path = os.path.join(state.base_dir, today)
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path, exist_ok=True)
-
-    message = request.form.get('message', '')
-    if message.strip():
-        file_id = generate_random_id(index)
-        file_path = os.path.join(dir_path, f"{file_id}.txt")
-        with open(file_path, 'w') as file:
-            file.write(message)
-        index[file_id] = [str(datetime.now().timestamp()), file_path, 'text', f"{file_id}.txt"]
-        state.bump()
-
-    if 'image' in request.files:
-        for image in request.files.getlist('image'):
-            if image.filename != '':
-                file_id = generate_random_id(index)
-                image_extension = validate_image(image.stream)
-                if image_extension:
-                    file_path = os.path.join(dir_path, f"{file_id}.{image_extension}")
-                    image.save(file_path)
-                    print(f"Image saved to {file_path}")
-                    index[file_id] = [str(datetime.now().timestamp()), file_path, 'image', image.filename]
-                    state.bump()
-                else:
-                    return jsonify({"success": False, "message": f"Invalid image file: {image.filename}"})
-
-    if 'video' in request.files:
-        for video in request.files.getlist('video'):
-            if video.filename != '':
-                file_id = generate_random_id(index)
-                video_extension = os.path.splitext(video.filename)[1]
-                if video_extension:
-                    file_path = os.path.join(dir_path, f"{file_id}{video_extension}")
-                    video.save(file_path)
-                    print(f"Video saved to {file_path}")
-                    index[file_id] = [str(datetime.now().timestamp()), file_path, 'video', video.filename]
-                    state.bump()
-                else:
-                    return jsonify({"success": False, "message": f"Invalid video file: {video.filename}"})
-
-    if 'file' in request.files:
-        for file in request.files.getlist('file'):
-            if file.filename != '':
-                file_id = generate_random_id(index)
-                file_extension = os.path.splitext(file.filename)[1]
-                file_path = os.path.join(dir_path, f"{file_id}{file_extension}")
-                file.save(file_path)
-                print(f"File saved to {file_path}")
-                index[file_id] = [str(datetime.now().timestamp()), file_path, 'file', file.filename]
-                state.bump()
+    # Before reading any of the body. Content-Length also counts the form's
+    # framing, so this errs on the side of refusing.
+    full = over_quota(state, request.content_length)
+    if full:
+        return jsonify({"success": False, "message": full}), 413
+    dir_path = today_dir(state)
+
+    # Multipart bodies are streamed part by part, each file written straight to
+    # its final path (no temp-file spool + copy). Anything else can only carry
+    # the text message.
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype == 'multipart/form-data' and boundary:
+        parts = iter_parts(request.stream, boundary, max_form_memory=request.max_form_memory_size)
+    else:
+        parts = request.form.items(multi=True)
+    seen_message = False
+    try:
+        for name, value in parts:
+            if name == 'message' and not seen_message:
+                seen_message = True
+                if isinstance(value, str) and value.strip():
+                    full = over_quota(state, len(value.encode('utf-8')))
+                    if full:
+                        return jsonify({"success": False, "message": full}), 413
+                    save_text(state, dir_path, value)
+            elif name in UPLOAD_FIELDS and isinstance(value, FilePart) and value.filename != '':
+                error = save_upload(state, dir_path, name, value)
+                if error:
+                    return jsonify({"success": False, "message": error})
+    except OverBudget as e:
+        return jsonify({"success": False, "message": over_budget(state, e)}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Malformed upload: {e}"}), 400
 
+    retention = board_retention(state.slug)
+    if retention:
+        reaper.schedule(state.slug, time.time() + retention)
     return jsonify({"success": True, "message": "Message saved successfully."})
 
 
+# Resumable uploads: POST /uploads {type, filename, size} starts one; each chunk
+# is PUT to /uploads/<id>?offset=<n> (any order, retried freely); GET shows the
+# offsets still missing; POST /uploads/<id>/finish files it into the board like
+# a normal upload; DELETE abandons it. Named boards use /b/<slug>/uploads...
+def _chunked_upload(state, upload_id):
+    '''The upload's metadata if it exists and belongs to this board; else 404.'''
+    meta = chunked_uploads.get(upload_id)
+    if meta is None or meta['board'] != (state.slug or ''):
+        abort(404)
+    return meta
+
+def _upload_status(meta):
+    try:
+        missing = chunked_uploads.missing(meta)
+    except FileNotFoundError:                  # finished or cancelled meanwhile
+        abort(404)
+    return {"success": True, "upload_id": meta['id'], "size": meta['size'],
+            "chunk_size": meta['chunk_size'], "missing": missing}
+
+@app.route('/uploads', methods=['POST'], defaults={'slug': None})
+@app.route('/b/<slug>/uploads', methods=['POST'])
+def upload_create(slug):
+    state, perm, authed = resolve(slug, 'post')
+    data = request.get_json(silent=True) or {}
+    msg_type = data.get('type', 'file')
+    filename = str(data.get('filename') or '')
+    if msg_type not in UPLOAD_FIELDS or not filename:
+        return jsonify({"success": False, "message": f"type must be one of {list(UPLOAD_FIELDS)} and filename is required."}), 400
+    if msg_type == 'video' and not os.path.splitext(filename)[1]:
+        return jsonify({"success": False, "message": f"Invalid video file: {filename}"}), 400
+    try:
+        size = int(data.get('size'))
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid size: {e}"}), 400
+    full = over_quota(state, size)
+    if full:
+        return jsonify({"success": False, "message": full}), 413
+    try:
+        meta = chunked_uploads.create(state.slug, msg_type, filename, size)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid size: {e}"}), 400
+    return jsonify(_upload_status(meta))
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'], defaults={'slug': None})
+@app.route('/b/<slug>/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_chunk(slug, upload_id):
+    state, perm, authed = resolve(slug, 'post')
+    meta = _chunked_upload(state, upload_id)
+    if request.method == 'DELETE':
+        chunked_uploads.abort(upload_id)
+        return jsonify({"success": True, "message": "Upload cancelled."})
+    if request.method == 'PUT':
+        try:
+            offset = int(request.args.get('offset', ''))
+            chunked_uploads.write_chunk(meta, offset, request.stream, request.content_length)
+        except (ValueError, TypeError) as e:
+            return jsonify({"success": False, "message": f"Invalid chunk: {e}"}), 400
+        except FileNotFoundError:
+            abort(404)
+    return jsonify(_upload_status(meta))
+
+@app.route('/uploads/<upload_id>/finish', methods=['POST'], defaults={'slug': None})
+@app.route('/b/<slug>/uploads/<upload_id>/finish', methods=['POST'])
+def upload_finish(slug, upload_id):
+    state, perm, authed = resolve(slug, 'post')
+    meta = _chunked_upload(state, upload_id)
+    dir_path = today_dir(state)
+    file_id = generate_random_id(state.index)
+    sniffed = {}
+
+    def choose_path(head):
+        sniffed['mime'] = detect_mime(head, meta['filename'])
+        return upload_path(dir_path, file_id, meta['type'], meta['filename'], head)
+
+    try:
+        file_path = chunked_uploads.finish(meta, choose_path, budget=quota_budget(state))
+    except OverBudget as e:
+        return jsonify({"success": False, "message": over_budget(state, e)}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Upload incomplete: {e}"}), 400
+    except FileNotFoundError:
+        abort(404)
+    if file_path is None:
+        return jsonify({"success": False, "message": f"Invalid {meta['type']} file: {meta['filename']}"})
+    digest = file_digest(file_path) if blob_store is not None else ''
+    duplicate = blob_store is not None and blob_store.intern(file_path, digest)
+    print(f"{meta['type'].capitalize()} saved to {file_path} ({meta['size']} bytes, resumable upload"
+          f"{', duplicate' if duplicate else ''})")
+    add_message(state, file_id, file_path, meta['type'], meta['filename'], sniffed['mime'], meta['size'],
+                digest=digest)
+    retention = board_retention(state.slug)
+    if retention:
+        reaper.schedule(state.slug, time.time() + retention)
+    return jsonify({"success": True, "message": "Message saved successfully.", "id": file_id})
+
+
 @app.route('/last-update', methods=['GET'], defaults={'slug': None})
 @app.route('/b/<slug>/last-update', methods=['GET'])
 def get_last_update(slug):
+    '''Return the board's update clock. With ?since=<last_update> this is a
+    long-poll: the request parks until the clock moves past `since` or
+    LONGPOLL_TIMEOUT elapses. "parked" tells the client whether it actually
+    waited, i.e. whether it may re-poll immediately or should back off.'''
     state, perm, authed = resolve(slug, 'read')
-    return jsonify({"last_update": state.last_update})
+    since = request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        since = None
+    if since is None or since != state.last_update:
+        tag = f'{state.last_update}-{perm}-{int(authed)}'
+        return not_modified(tag) or tagged(jsonify({"last_update": state.last_update, "parked": False}), tag)
+    if longpoll_slots is None or not longpoll_slots.acquire(blocking=False):
+        return jsonify({"last_update": state.last_update, "parked": False})
+    try:
+        last_update = state.wait(since, LONGPOLL_TIMEOUT)
+    finally:
+        longpoll_slots.release()
+    return jsonify({"last_update": last_update, "parked": True})
+
+
+def _row_time(row, retention, now):
+    '''Return a row's unix_time, or None if the entry is stale: a blank/partial
+    tombstone row, past retention, or its file is gone.'''
+    # A deleted entry can resurrect as a blank/partial row after a TSVZ
+    # reload (its tombstone reloads with empty fields). Treat any row whose
+    # timestamp won't parse as a stale entry to reap, rather than letting
+    # float('') take down the whole listing with a 500.
+    try:
+        unix_time = float(row[1])
+    except (ValueError, TypeError, IndexError):
+        return None
+    if retention and now - unix_time > retention:
+        return None
+    if not os.path.exists(row[2]):
+        return None
+    return unix_time
+
+def _message_entry(state, id, row, unix_time):
+    '''The JSON shape of one message in a listing. A text longer than
+    TEXT_INLINE_LIMIT is not inlined: its content is a preview, with
+    truncated=true and "full" the URL of the whole body.'''
+    prefix = f'/b/{state.slug}' if state.slug else ''
+    msg_type = row[3]
+    size = _row_size(row)
+    extra = {}
+    if msg_type == 'image':
+        content = f'{prefix}/image/{id}'
+    elif msg_type == 'text':
+        if size is None:
+            size = os.path.getsize(row[2])
+        if TEXT_INLINE_LIMIT and size > TEXT_INLINE_LIMIT:
+            content = text_preview(state, id, row[2])
+            extra = {"truncated": True, "full": f'{prefix}/text/{id}'}
+        else:
+            content = read_text(state, id, row[2])
+    elif msg_type == 'video':
+        content = f'{prefix}/video/{id}'
+    elif msg_type == 'file':
+        content = f'{prefix}/file/{id}'
+    else:
+        content = "Content type not supported."
+    return {"id": id, "content": content, "timestamp": int(unix_time), "type": msg_type, "filename": row[4],
+            "mime": row[5] or None, "size": size, "thumb": _thumb_url(prefix, id, msg_type), **extra}
+
+def _thumb_url(prefix, id, msg_type):
+    '''The preview to show in a listing instead of the file, or None. /thumb
+    falls back to an image itself; a video's poster is a 404 until it is made.
+    The URL does not depend on whether the thumbnail exists yet, so a listing
+    only changes with the board's clock (see the ETag in get_messages).'''
+    if thumbnailer is None or not thumbnailer.can(msg_type):
+        return None
+    return f'{prefix}/thumb/{id}'
+
+def _row_digest(row):
+    '''The sha256 recorded in a row; '' for rows saved before digests were.'''
+    return row[7] if len(row) > 7 else ''
+
+def _row_size(row):
+    '''The byte size recorded in a row; None for rows saved before sizes were
+    (see `admin backfill-meta`).'''
+    try:
+        return int(row[6])
+    except (ValueError, TypeError, IndexError):
+        return None
+
+def _messages_delta(state, changes, retention, now):
+    '''Fold changelog entries into (added messages newest first, deleted ids).'''
+    added = {}                        # id -> None, in insertion (time) order
+    deleted = set()
+    stale = []
+    for _stamp, op, mid in changes:
+        if op == 'add':
+            added[mid] = None
+        elif op == 'delete':
+            added.pop(mid, None)
+            deleted.add(mid)
+    messages = []
+    for mid in added:
+        row = state.index[mid] if mid in state.index else None
+        unix_time = _row_time(row, retention, now) if row is not None else None
+        if unix_time is None:
+            deleted.add(mid)
+            if row is not None:
+                stale.append(mid)
+            continue
+        messages.append(_message_entry(state, mid, row, unix_time))
+    if stale:
+        reaper.purge_soon(state.slug, stale)
+    messages.reverse()
+    return messages, sorted(deleted)
+
+
+def _encode_page_cursor(entry):
+    '''(unix_time, id) from BoardState.page() -> opaque "<time>_<id>" string.'''
+    return None if entry is None else f'{entry[0]!r}_{entry[1]}'
+
+def _decode_page_cursor(value):
+    if not value:
+        return None
+    unix_time, sep, mid = value.rpartition('_')
+    if not sep or not mid:
+        raise ValueError(value)
+    return (float(unix_time), mid)
+
+def _positive_int(value):
+    if not value:
+        return None
+    n = int(value)
+    if n <= 0:
+        raise ValueError(value)
+    return n
 
 
 @app.route('/messages', methods=['GET'], defaults={'slug': None})
 @app.route('/b/<slug>/messages', methods=['GET'])
 def get_messages(slug):
+    '''List a board, newest first.
+
+    ?limit=N returns only the newest N; "next" is then the cursor for
+    ?before=<next>&limit=N (older pages, null when exhausted). ?since=<last_update>
+    returns only changes (see BoardState.changes_since); when it can't, the reply
+    is a first page with resync=true.
+
+    Replies carry an ETag built from the board's update clock, its settings
+    and the caller's access, so If-None-Match gets a 304 without a scan.'''
     state, perm, authed = resolve(slug, 'read')
     index = state.index
     retention = board_retention(state.slug)
-    prefix = f'/b/{state.slug}' if state.slug else ''
-    messages = []
-    message_to_delete = []
+    meta = boards.meta(state.slug) if state.slug else None
+    settings = zlib.crc32(repr((meta['display'], meta['retention']) if meta else None).encode())
+    tag = f'{state.last_update}-{perm}-{int(authed)}-{settings:08x}-{version}'
+    cached = not_modified(tag)
+    if cached is not None:
+        return cached
     now = datetime.now().timestamp()
-    # Iterate over a snapshot of the keys so a concurrent POST/delete cannot
-    # mutate the index mid-iteration; re-check membership before each access.
-    for id in list(index):
+    reply = {"board": state.slug, "perm": perm, "authed": authed,
+             "display": (meta['display'] if meta else None),
+             "retention": (meta['retention'] if meta else None)}
+
+    # ?since=<last_update>: answer from the changelog when the cursor is still
+    # covered by it; otherwise fall through to a full listing with resync=True.
+    try:
+        limit = _positive_int(request.args.get('limit'))
+        before = _decode_page_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid page cursor."}), 400
+    since = request.args.get('since')
+    if since and before is None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid cursor."}), 400
+        changes, cursor = state.changes_since(since)
+        if changes is not None:
+            messages, deleted = _messages_delta(state, changes, retention, now)
+            return tagged(jsonify({"messages": messages, "deleted": deleted, "resync": False,
+                                   "last_update": cursor, **reply}), tag)
+
+    # Take the cursor BEFORE the scan: a change racing the scan is then
+    # re-delivered by the next delta rather than lost.
+    cursor = state.last_update
+    ids, next_page = state.page(before, limit)
+    messages = []
+    stale = []
+    # ids is a snapshot, so a concurrent POST/delete cannot mutate it
+    # mid-iteration; re-check membership before each access. Stale entries are
+    # skipped and handed to the reaper, so the listing itself stays read-only
+    # and they do not linger in the index, the timeline and the board's bytes.
+    for id in ids:
         row = index[id] if id in index else None
         if row is None:
             continue
-        # A deleted entry can resurrect as a blank/partial row after a TSVZ
-        # reload (its tombstone reloads with empty fields). Treat any row whose
-        # timestamp won't parse as a stale entry to reap, rather than letting
-        # float('') take down the whole listing with a 500.
-        try:
-            unix_time = float(row[1])
-        except (ValueError, TypeError, IndexError):
-            message_to_delete.append(id)
+        unix_time = _row_time(row, retention, now)
+        if unix_time is None:
+            stale.append(id)
             continue
-        file_path, msg_type = row[2], row[3]
-        if retention and now - unix_time > retention:
-            message_to_delete.append(id)
-            continue
-        if not os.path.exists(file_path):
-            message_to_delete.append(id)
-            continue
-        if msg_type == 'image':
-            content = f'{prefix}/image/{id}'
-        elif msg_type == 'text':
-            with open(file_path, 'r') as file:
-                content = file.read()
-        elif msg_type == 'video':
-            content = f'{prefix}/video/{id}'
-        elif msg_type == 'file':
-            content = f'{prefix}/file/{id}'
-        else:
-            content = "Content type not supported."
-        messages.append({"id": id, "content": content, "timestamp": int(unix_time), "type": msg_type, "filename": row[4]})
-    messages.reverse()
-    for id in message_to_delete:
-        _purge(state, id)
-    meta = boards.meta(state.slug) if state.slug else None
-    return jsonify({"messages": messages, "board": state.slug, "perm": perm,
-                    "authed": authed, "display": (meta['display'] if meta else None),
-                    "retention": (meta['retention'] if meta else None)})
-
+        messages.append(_message_entry(state, id, row, unix_time))
+    if stale:
+        reaper.purge_soon(state.slug, stale)
+    reply.update(messages=messages, next=_encode_page_cursor(next_page))
+    if before is None:
+        reply.update(deleted=[], resync=True, last_update=cursor)
+    return tagged(jsonify(reply), tag)
+
+
+def serve_file(file_path, download_name, mimetype=None):
+    '''Send a (path-confined) file. By default Python streams it, answering
+    Range and conditional (If-None-Match / If-Modified-Since) requests, so
+    video seeking fetches only what it needs. With SENDFILE set, only headers
+    are produced and the front server sends the bytes, doing Range and
+    conditionals itself: 'x-sendfile' emits X-Sendfile with the absolute path
+    (Apache, lighttpd); 'x-accel-redirect' emits X-Accel-Redirect to
+    X_ACCEL_PREFIX + the path relative to X_ACCEL_ROOT, for an nginx
+    `internal` location; a file outside X_ACCEL_ROOT is served by Python as
+    without SENDFILE.'''
+    accel = None
+    if SENDFILE == 'x-accel-redirect':
+        accel = os.path.relpath(os.path.abspath(file_path), X_ACCEL_ROOT)
+        if accel == os.pardir or accel.startswith(os.pardir + os.sep):
+            _warn_outside_accel_root(file_path)
+            accel = None                        # nginx cannot reach it: Python serves it
+    offload = SENDFILE == 'x-sendfile' or accel is not None
+    response = send_file(file_path, mimetype=mimetype, download_name=download_name,
+                         conditional=not offload, etag=not offload)
+    if accel is not None:
+        response.close()                        # nginx reads the file, not us
+        response.response = []
+        response.automatically_set_content_length = False
+        del response.headers['Content-Length']
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + quote(accel.replace(os.sep, '/'))
+    return response
+
+_accel_warned = False
+
+def _warn_outside_accel_root(file_path):
+    global _accel_warned
+    if not _accel_warned:
+        _accel_warned = True
+        print(f"SENDFILE: {file_path} is outside X_ACCEL_ROOT ({X_ACCEL_ROOT}); "
+              f"serving such files from Python")
 
 @app.route('/image/<message_id>', methods=['GET'], defaults={'slug': None})
 @app.route('/video/<message_id>', methods=['GET'], defaults={'slug': None})
@@ -569,19 +1229,52 @@ def get_messages(slug):
 @app.route('/b/<slug>/file/<message_id>', methods=['GET'])
 def get_file(slug, message_id):
     state, perm, authed = resolve(slug, 'read')
-    index = state.index
     message_id = os.path.splitext(message_id)[0]  # tolerate an extension in the URL
+    return serve_message(state, message_id)
+
+@app.route('/text/<message_id>', methods=['GET'], defaults={'slug': None})
+@app.route('/b/<slug>/text/<message_id>', methods=['GET'])
+def get_text(slug, message_id):
+    '''A text message's whole body, streamed (listings carry only a preview
+    of long ones).'''
+    state, perm, authed = resolve(slug, 'read')
+    message_id = os.path.splitext(message_id)[0]
+    row = state.index[message_id] if message_id in state.index else None
+    if row is None or row[3] != 'text' or not os.path.exists(row[2]):
+        abort(404, description="Message not found.")
+    return plaintext(stream_with_context(iter_text(state, message_id, row[2])))
+
+@app.route('/thumb/<message_id>', methods=['GET'], defaults={'slug': None})
+@app.route('/b/<slug>/thumb/<message_id>', methods=['GET'])
+def get_thumb(slug, message_id):
+    state, perm, authed = resolve(slug, 'read')
+    message_id = os.path.splitext(message_id)[0]
+    return serve_message(state, message_id, thumb=True)
+
+def serve_message(state, message_id, thumb=False):
+    '''Serve a message's file, confined to its board's directory. With
+    `thumb`, serve its thumbnail instead; an image that has none (yet) is
+    served whole.'''
+    index = state.index
     if message_id in index:
         file_path = index[message_id][2]
         # Confine to this board's directory before serving.
         base = os.path.normpath(state.base_dir)
         if os.path.commonpath([base, os.path.normpath(file_path)]) != base:
             abort(404, description="Path not valid.")
+        if thumb:
+            small = Thumbnailer.path_of(file_path)
+            if os.path.exists(small):
+                return serve_file(small, f"{message_id}.jpg", 'image/jpeg')
+            if index[message_id][3] != 'image':
+                abort(404, description="No thumbnail.")
         if os.path.exists(file_path):
-            mime = filetype.guess(file_path)
-            if mime is not None:
-                return send_file(file_path, mimetype=mime.mime, download_name=index[message_id][4])
-            return send_file(file_path, download_name=index[message_id][4])
+            row = index[message_id]
+            mime = row[5]
+            if not mime:                        # saved before MIME types were recorded
+                kind = filetype.guess(file_path)
+                mime = kind.mime if kind is not None else None
+            return serve_file(file_path, row[4], mime)
         abort(404, description="File not found.")
     abort(404, description="Message not found.")
 
@@ -589,26 +1282,191 @@ def get_file(slug, message_id):
 @app.route('/delete_all', methods=['POST'], defaults={'slug': None})
 @app.route('/b/<slug>/delete_all', methods=['POST'])
 def delete_all_messages(slug):
+    '''Empty the board at once; its files are deleted in the background.'''
     state, perm, authed = resolve(slug, 'delete')
-    for id in list(state.index):
-        delete_file_on_disk(state.index, id)
-    state.index.clear()
-    state.bump()
+    with state.mutating():
+        files = [(row[2], _row_digest(row)) for _, row in state.index.items()
+                 if len(row) > 2 and row[2]]
+        state.index.clear()
+        text_cache.discard_board(state.slug)
+        state.bump('clear')
+    discard_queue.submit(files)
     return jsonify({"success": True, "message": "All messages have been deleted."})
 
 
+DELETE_BATCH_MAX = 10000              # ids one /delete_many request may name
+
+@app.route('/delete_many', methods=['POST'], defaults={'slug': None})
+@app.route('/b/<slug>/delete_many', methods=['POST'])
+def delete_messages(slug):
+    '''Delete several messages: a JSON list of ids (or {"ids": [...]}), or
+    repeated `id` form fields. The index is changed in one pass and the change
+    announced once; the files are deleted in the background.'''
+    state, perm, authed = resolve(slug, 'delete')
+    body = request.get_json(silent=True)
+    ids = body.get('ids') if isinstance(body, dict) else body
+    if ids is None:
+        ids = request.form.getlist('id')
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return jsonify({"success": False, "message": "Expected a list of message ids."}), 400
+    if len(ids) > DELETE_BATCH_MAX:
+        return jsonify({"success": False,
+                        "message": f"At most {DELETE_BATCH_MAX} ids per request."}), 400
+    ids = list(dict.fromkeys(ids))
+    with state.mutating():
+        index = state.index
+        found = [i for i in ids if i in index]
+        files = [(index[i][2], _row_digest(index[i])) for i in found]
+        index.delete_many(found)
+        for i in found:
+            text_cache.discard((state.slug, i))
+        if found:
+            state.bump_many('delete', found)
+    discard_queue.submit(files)
+    gone = set(found)
+    missing = [i for i in ids if i not in gone]
+    return jsonify({"success": True, "deleted": found, "missing": missing,
+                    "message": f"{len(found)} messages deleted."})
+
+
 @app.route('/delete/<message_id>', methods=['POST'], defaults={'slug': None})
 @app.route('/b/<slug>/delete/<message_id>', methods=['POST'])
 def delete_message(slug, message_id):
     state, perm, authed = resolve(slug, 'delete')
-    if message_id in state.index:
-        delete_file_on_disk(state.index, message_id)
-        del state.index[message_id]
-        state.bump()
-        return jsonify({"success": True, "message": f"Message {message_id} deleted successfully."})
+    with state.mutating():
+        if message_id in state.index:
+            delete_file_on_disk(state.index, message_id)
+            del state.index[message_id]
+            text_cache.discard((state.slug, message_id))
+            state.bump('delete', message_id)
+            return jsonify({"success": True, "message": f"Message {message_id} deleted successfully."})
     return jsonify({"success": False, "message": "Message not found."})
 
 
+# ---------------------------------------------------------------------------
+# Board export / import: streamed tar archives (see archive.py)
+# ---------------------------------------------------------------------------
+def board_archive(state, info, with_secret=False):
+    '''The board's archive as a stream of chunks. Messages are looked up page
+    by page as the stream goes and no lock is held across it, so the board
+    stays writable; what is posted meanwhile may or may not be included.
+    The TOTP secret is included only `with_secret` (`admin export-board
+    --with-secret`), never over HTTP: whoever holds it can log in for good.'''
+    meta = {'slug': info.slug, 'display': info.display, 'perm': info.perm,
+            'retention': info.retention, 'created': info.created}
+    if with_secret:
+        meta['secret'] = info.secret
+    return write_archive(meta, _archive_messages(state))
+
+def _archive_messages(state):
+    base = os.path.normpath(state.base_dir)
+    retention = board_retention(state.slug)
+    now = time.time()
+    before = None
+    while True:
+        ids, before = state.page(before, TIMELINE_PAGE)
+        for mid in ids:
+            row = state.index[mid] if mid in state.index else None
+            unix_time = _row_time(row, retention, now) if row is not None else None
+            if unix_time is None:
+                continue
+            rel = os.path.relpath(os.path.normpath(row[2]), base)
+            if rel.startswith('..'):
+                continue
+            message = {'id': mid, 'unix_time': unix_time, 'path': rel.replace(os.sep, '/'),
+                       'type': row[3], 'filename': row[4], 'mime': row[5] or None,
+                       'size': _row_size(row)}
+            yield message, row[2]
+        if before is None:
+            return
+
+_ARCHIVE_ID = re.compile(r'^[A-Za-z0-9]{1,32}$')
+_ARCHIVE_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def import_archive(state_of, stream, budget=None):
+    '''Add the messages of a board archive read from `stream` to the board
+    state_of() returns, each keeping its id and time unless the id is taken
+    there. Files are unpacked into a staging directory and moved into the
+    board only once the whole archive has been read, so a failed import leaves
+    nothing behind (state_of is not even called). Returns (the archive's
+    board.json, messages imported); ValueError if unreadable, OverBudget if
+    its files come to more than `budget` bytes.'''
+    os.makedirs(BOARDS_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.import-', dir=BOARDS_DIR)
+    staged = {}                       # staged path -> (date dir, id wanted, extension)
+    def place(rel):
+        date_dir, name = os.path.split(rel)
+        if not _ARCHIVE_DATE.match(date_dir):
+            date_dir = datetime.now().strftime("%Y-%m-%d")
+        stem = os.path.splitext(name)[0]
+        path = os.path.join(staging, str(len(staged)))
+        staged[path] = (date_dir, stem, file_extension(name))
+        return path
+
+    try:
+        meta, imported = read_archive(stream, place, budget=budget)
+        if not imported:
+            return meta, 0
+        state = state_of()
+        taken = set()
+        for message, path, size, digest in imported:
+            date_dir, file_id, extension = staged[path]
+            while not _ARCHIVE_ID.match(file_id) or file_id in state.index or file_id in taken:
+                file_id = generate_random_id(state.index)
+            taken.add(file_id)
+            dir_path = os.path.join(state.base_dir, date_dir)
+            os.makedirs(dir_path, exist_ok=True)
+            file_path = os.path.join(dir_path, f"{file_id}{extension}")
+            os.replace(path, file_path)
+            msg_type = message.get('type')
+            if msg_type not in ('text',) + UPLOAD_FIELDS:
+                msg_type = 'file'
+            if blob_store is not None:
+                blob_store.intern(file_path, digest)
+            add_message(state, file_id, file_path, msg_type,
+                        message.get('filename') or os.path.basename(file_path),
+                        message.get('mime') or '', size, unix_time=_archive_time(message.get('unix_time')),
+                        digest=digest)
+        reaper.schedule(state.slug, 0)    # imported messages may already be due
+        return meta, len(imported)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _archive_time(value):
+    '''An archived message's unix time as the index stores it; now if it is
+    missing or not a number, since the timeline could not place the row.'''
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return int(time.time())
+
+@app.route('/b/<slug>/export', methods=['GET'])
+def board_export(slug):
+    '''Download the board (index + files) as a tar archive, streamed.'''
+    state, perm, authed = resolve(slug, 'admin')
+    info = boards.lookup(state.slug)
+    name = f"wpaste-{state.slug}-{datetime.now():%Y%m%d-%H%M%S}.tar"
+    response = Response(stream_with_context(board_archive(state, info)), mimetype='application/x-tar')
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+@app.route('/b/<slug>/import', methods=['POST'])
+def board_import(slug):
+    '''Merge an exported archive, sent as the raw request body, into this
+    board. The board's own settings and secret are left as they are.'''
+    state, perm, authed = resolve(slug, 'admin')
+    full = over_quota(state, request.content_length)
+    if full:
+        return jsonify({"success": False, "message": full}), 413
+    try:
+        meta, count = import_archive(lambda: state, request.stream, budget=quota_budget(state))
+    except OverBudget as e:
+        return jsonify({"success": False, "message": over_budget(state, e)}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "imported": count})
+
+
 # ---------------------------------------------------------------------------
 # Routes — board access / auth lifecycle
 # ---------------------------------------------------------------------------
@@ -711,6 +1569,7 @@ def board_settings(slug):
             except (ValueError, TypeError):
                 return jsonify({"success": False, "message": "Invalid retention."}), 400
         boards.set_retention(cslug, rv)
+        reaper.schedule(cslug, 0)         # re-evaluate under the new retention now
     state.bump()
     m = boards.meta(cslug)
     return jsonify({"success": True, "perm": m['perm'], "retention": m['retention']})
@@ -720,16 +1579,47 @@ def board_settings(slug):
 def board_delete(slug):
     state, perm, authed = resolve(slug, 'admin')
     cslug = state.slug
-    boards.delete(cslug)
+    released = None
+    if blob_store is not None:
+        digests = [_row_digest(row) for _, row in state.index.items()]
+        def released():
+            # After the board's files are gone, this request's pin included.
+            for digest in digests:
+                blob_store.release(digest)
+    boards.delete(cslug, then=released)
+    trash.discard_under(state.base_dir)
+    text_cache.discard_board(cslug)
     _clear_session(cslug)
     return jsonify({"success": True})
 
 
 # ---------------------------------------------------------------------------
-# Admin CLI: `python app.py admin <list|remove-board|regen-totp>`
+# Admin CLI: `python app.py admin <list|remove-board|regen-totp|migrate-index|
+#             backfill-meta|export-board|import-board>`
 # Run while the service is stopped (it mutates TSVZ-backed files the running
 # process holds in memory).
 # ---------------------------------------------------------------------------
+def backfill_meta(state):
+    '''Fill in the MIME type and size of rows written before the index had
+    those columns; returns how many rows were updated.'''
+    updated = 0
+    with state.mutating():
+        for mid, row in list(state.index.items()):
+            if row[5] and row[6]:
+                continue
+            try:
+                with open(row[2], 'rb') as fh:
+                    head = fh.read(SNIFF_SIZE)
+                size = os.path.getsize(row[2])
+            except (OSError, IndexError):
+                continue                        # tombstone or file already gone
+            mime = 'text/plain' if row[3] == 'text' else detect_mime(head, row[4])
+            state.index[mid] = [row[1], row[2], row[3], row[4], mime, str(size)] + row[7:]
+            updated += 1
+        if updated:
+            state.index.flush()
+    return updated
+
 def run_admin(argv):
     import argparse
     parser = argparse.ArgumentParser(prog='app.py admin', description='wpaste board administration')
@@ -739,6 +1629,16 @@ def run_admin(argv):
     p_rm.add_argument('slug')
     p_rg = sub.add_parser('regen-totp', help='issue a new TOTP secret (invalidates all sessions)')
     p_rg.add_argument('slug')
+    sub.add_parser('migrate-index', help='import every .tsv/.nsv table into the configured INDEX_BACKEND')
+    sub.add_parser('backfill-meta', help='record MIME type and size for messages saved before they were')
+    p_ex = sub.add_parser('export-board', help='write a board archive (tar) of its messages, files and settings')
+    p_ex.add_argument('slug')
+    p_ex.add_argument('archive', help='file to write')
+    p_ex.add_argument('--with-secret', action='store_true',
+                      help="include the board's TOTP secret (anyone holding the archive can then log in)")
+    p_im = sub.add_parser('import-board', help='load a board archive, creating the board from it if needed')
+    p_im.add_argument('slug')
+    p_im.add_argument('archive', help='archive file, or - for stdin')
     args = parser.parse_args(argv)
 
     if args.cmd == 'list':
@@ -746,8 +1646,11 @@ def run_admin(argv):
         if not rows:
             print('No boards.')
         for m in rows:
-            ntok = len([t for t in boards.registry[m['slug']][4].split(',') if t])
-            print(f"{m['slug']}\tperm={m['perm']}\tsessions={ntok}\tcreated={m['created']}\tdisplay={m['display']}")
+            ntok = len(boards.lookup(m['slug']).tokens)
+            print(f"{m['slug']}\tperm={m['perm']}\tsessions={ntok}\tbytes={boards.usage_of(m['slug'])}"
+                  f"\tcreated={m['created']}\tdisplay={m['display']}")
+        quota = f" of {DISK_QUOTA}" if DISK_QUOTA else ''
+        print(f"default board: bytes={default_board.bytes}\ttotal: bytes={disk_usage.total}{quota}")
     elif args.cmd == 'remove-board':
         cslug = canonical_slug(args.slug)
         if cslug and boards.delete(cslug):
@@ -765,11 +1668,84 @@ def run_admin(argv):
             print(f"  secret:  {secret}")
             print(f"  otpauth: {provisioning_uri(secret, m['display'])}")
             print("All existing sessions were invalidated.")
+    elif args.cmd == 'migrate-index':
+        # Opening a table migrates it, so by now the default board and the
+        # registry are done; opening every board does the rest.
+        if INDEX_BACKEND == 'tsvz':
+            print(f"INDEX_BACKEND is 'tsvz'; set it to one of {[b for b in BACKENDS if b != 'tsvz']} first.")
+        else:
+            for m in boards.list_boards():
+                n = len(boards.state(m['slug']).index)
+                print(f"{m['slug']}\t{n} messages")
+            print(f"default\t{len(mainIndex)} messages")
+            print(f"registry\t{len(boards.registry)} boards")
+
+    elif args.cmd == 'backfill-meta':
+        for m in [None] + boards.list_boards():
+            state = default_board if m is None else boards.state(m['slug'])
+            print(f"{m['slug'] if m else 'default'}\t{backfill_meta(state)} messages updated")
+
+    elif args.cmd == 'export-board':
+        cslug = canonical_slug(args.slug)
+        info = boards.lookup(cslug) if cslug else None
+        if info is None:
+            print(f"No such board: {args.slug}")
+        else:
+            with open(args.archive, 'wb') as out:
+                for chunk in board_archive(boards.state(cslug), info, with_secret=args.with_secret):
+                    out.write(chunk)
+            print(f"Exported board '{cslug}' to {args.archive}")
 
-    boards.registry.close()
+    elif args.cmd == 'import-board':
+        cslug = canonical_slug(args.slug)
+        if cslug is None:
+            print(f"Invalid board name: {args.slug}")
+        else:
+            src = sys.stdin.buffer if args.archive == '-' else open(args.archive, 'rb')
+            try:
+                with src:
+                    meta, count = import_archive(lambda: boards.state(cslug), src)
+            except ValueError as e:
+                print(f"Import failed: {e}")
+            else:
+                if not boards.exists(cslug):
+                    secret = boards.create(cslug, meta.get('display') or cslug,
+                                           perm=meta.get('perm', DEFAULT_PERM),
+                                           retention=meta.get('retention', ''),
+                                           secret=meta.get('secret') or None)
+                    if meta.get('secret'):
+                        print(f"Created board '{cslug}' with the archive's settings and TOTP secret.")
+                    else:
+                        print(f"Created board '{cslug}' with the archive's settings and a new TOTP:")
+                        print(f"  secret:  {secret}")
+                        print(f"  otpauth: {provisioning_uri(secret, boards.meta(cslug)['display'])}")
+                print(f"Imported {count} messages into '{cslug}'.")
+
+    boards.close()
     mainIndex.close()
 
 
+# Retention runs in the background. Every board is examined once at startup
+# (boards nobody reads still expire), then whenever its oldest message is due.
+# Abandoned partial uploads are swept by their own thread, unreferenced blobs
+# by the blob store's collector, soft-deleted files by the trash sweeper, the
+# files of batch-deleted messages by the discard queue; idle board indexes are
+# closed and the registry compacted by the boards maintenance thread.
+# Not in admin mode: that process only edits the registry and exits.
+if not (__name__ == '__main__' and sys.argv[1:2] == ['admin']):
+    for _slug in [None] + [m['slug'] for m in boards.list_boards()]:
+        reaper.schedule(_slug, 0)
+    reaper.start()
+    boards.start()
+    chunked_uploads.start()
+    trash.start()
+    discard_queue.start()
+    if thumbnailer is not None:
+        thumbnailer.start()
+    if blob_store is not None:
+        blob_store.start()
+
+
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == 'admin':
         run_admin(sys.argv[2:])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+'''
+archive.py — streaming board export/import for wpaste.
+
+A board archive is a plain (POSIX pax) tar file:
+    board.json          the board's registry row (slug, display, perm,
+                        retention, created; secret only when asked for) and
+                        the format version
+    files/<relpath>     each message's file, at its path under the board's
+                        directory (<date>/<id>.<ext>)
+    messages.jsonl      one JSON object per message: id, unix_time, path
+                        (the relpath above), type, filename, mime, size
+messages.jsonl comes last and lists only the files actually written, so a
+message deleted while its board is being exported simply drops out.
+
+write_archive() produces the archive as a stream of byte chunks. Tar headers
+are written by hand rather than through tarfile's writer, which would copy a
+whole member into memory, so a multi-GB board is exported with one file open
+and one chunk in flight, without a temp copy and without holding any lock.
+read_archive() unpacks one as it arrives (e.g. straight from a request body),
+within a byte budget if it is given one.
+'''
+import os
+import json
+import time
+import hashlib
+import tarfile
+
+from uploads import OverBudget
+
+ARCHIVE_VERSION = 1
+CHUNK_SIZE = 1024 * 1024          # bytes read from a file per yielded chunk
+BLOCK = tarfile.BLOCKSIZE
+MESSAGE_FIELDS = ('id', 'unix_time', 'path', 'type', 'filename', 'mime', 'size')
+
+
+def _header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _member(name, data):
+    '''A whole small member: header, data and padding.'''
+    return _header(name, len(data), time.time()) + data + b'\0' * (-len(data) % BLOCK)
+
+
+def write_archive(meta, messages, chunk_size=CHUNK_SIZE):
+    '''Yield a board archive. `meta` is the board's registry fields and
+    `messages` an iterable of (message, path): the message dict (see
+    MESSAGE_FIELDS; its 'path' is the archive relpath) and the file on disk.
+    It is consumed lazily, so a message whose file is gone by the time it
+    comes up is skipped.'''
+    yield _member('board.json', json.dumps(dict(meta, version=ARCHIVE_VERSION)).encode())
+    written = []
+    for message, path in messages:
+        try:
+            fh = open(path, 'rb')
+        except OSError:
+            continue                      # deleted since the listing
+        with fh:
+            st = os.fstat(fh.fileno())
+            # Files are never rewritten in place, so the size seen now holds.
+            yield _header('files/' + message['path'], st.st_size, st.st_mtime)
+            remaining = st.st_size
+            while remaining:
+                data = fh.read(min(chunk_size, remaining))
+                if not data:              # truncated under us: pad to the promised size
+                    data = b'\0' * min(chunk_size, remaining)
+                remaining -= len(data)
+                yield data
+            yield b'\0' * (-st.st_size % BLOCK)
+        written.append(message)
+    index = ''.join(json.dumps({k: m.get(k) for k in MESSAGE_FIELDS}) + '\n' for m in written)
+    yield _member('messages.jsonl', index.encode())
+    yield b'\0' * (2 * BLOCK)             # end-of-archive marker
+
+
+def _safe_relpath(name):
+    '''The relpath of a files/ member, or None if it could escape the board.'''
+    rel = os.path.normpath(name[len('files/'):])
+    if os.path.isabs(rel) or rel.startswith('..') or rel in ('', '.'):
+        return None
+    return rel
+
+
+def read_archive(stream, place, chunk_size=CHUNK_SIZE, budget=None):
+    '''Unpack a board archive from `stream` as it is read. place(relpath)
+    returns where to write the file the export had at `relpath`, or None to
+    skip it. Returns (meta, imported), imported being (message, path, size,
+    sha256 hex digest) for every listed message whose file arrived. Files no
+    message refers to are removed again. Raises ValueError on a malformed
+    archive and OverBudget once its files come to more than `budget` bytes,
+    in both cases after removing what it had written.'''
+    meta, messages, files = None, None, {}
+    total = 0
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if member.name == 'board.json':
+                    meta = json.load(tar.extractfile(member))
+                elif member.name == 'messages.jsonl':
+                    lines = tar.extractfile(member).read().decode('utf-8').splitlines()
+                    messages = [json.loads(line) for line in lines if line.strip()]
+                elif member.name.startswith('files/'):
+                    rel = _safe_relpath(member.name)
+                    path = place(rel) if rel is not None else None
+                    if path is None:
+                        continue
+                    # A member is exactly member.size bytes long: refuse it
+                    # before writing any of it.
+                    total += member.size
+                    if budget is not None and total > budget:
+                        raise OverBudget(budget)
+                    src = tar.extractfile(member)
+                    digest = hashlib.sha256()
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as fh:
+                        files[rel] = (path, member.size, None)
+                        for data in iter(lambda: src.read(chunk_size), b''):
+                            fh.write(data)
+                            digest.update(data)
+                    files[rel] = (path, member.size, digest.hexdigest())
+    except OverBudget:
+        _remove(path for path, _, _ in files.values())
+        raise
+    except (tarfile.TarError, ValueError, KeyError, OSError) as e:
+        _remove(path for path, _, _ in files.values())
+        raise ValueError(f'not a readable board archive: {e}') from e
+    if meta is None or messages is None:
+        _remove(path for path, _, _ in files.values())
+        raise ValueError('not a board archive: board.json or messages.jsonl missing')
+    imported = []
+    for message in messages:
+        rel = _safe_relpath('files/' + str(message.get('path') or ''))
+        if rel in files:
+            imported.append((message,) + files.pop(rel))
+    _remove(path for path, _, _ in files.values())
+    return meta, imported
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''
+Rate limiter throughput/memory benchmark.
+
+Hammers boards.RateLimiter from N threads with the mix wpaste produces (board
+lookups through allow(), TOTP checks through locked_out(), the odd
+record_failure()) over a large pool of client keys, as a scan from many IPs
+would, and reports ops/s, the worst single call once housekeeping is due,
+and memory held per key. The previous implementation (one deque of
+timestamps per key behind one lock, with a periodic full sweep) is included
+as the baseline.
+
+    python benchmarks/ratelimit_bench.py [--ops 200000] [--keys 50000]
+'''
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from boards import RateLimiter
+
+# print with flush on
+from functools import partial
+print = partial(print, flush=True)
+
+
+class DequeRateLimiter:
+    '''The pre-striping implementation, kept here as the baseline.'''
+    def __init__(self, sweep_interval=600.0):
+        self._events = {}
+        self._fails = {}
+        self._lock = threading.Lock()
+        self._max_window = 0.0
+        self._sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self._sweep_interval:
+            return
+        self._last_sweep = now
+        for store in (self._events, self._fails):
+            for k in list(store):
+                dq = store[k]
+                while dq and now - dq[0] > self._max_window:
+                    dq.popleft()
+                if not dq:
+                    del store[k]
+
+    def allow(self, key, max_events, window):
+        now = time.monotonic()
+        with self._lock:
+            self._max_window = max(self._max_window, window)
+            self._sweep(now)
+            dq = self._events.setdefault(key, deque())
+            while dq and now - dq[0] > window:
+                dq.popleft()
+            if len(dq) >= max_events:
+                return False
+            dq.append(now)
+            return True
+
+    def record_failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            self._fails.setdefault(key, deque()).append(now)
+
+    def locked_out(self, key, max_fails, window):
+        now = time.monotonic()
+        with self._lock:
+            self._max_window = max(self._max_window, window)
+            self._sweep(now)
+            dq = self._fails.setdefault(key, deque())
+            while dq and now - dq[0] > window:
+                dq.popleft()
+            locked = len(dq) >= max_fails
+            if not dq:
+                del self._fails[key]
+            return locked
+
+    def __len__(self):
+        return len(self._events) + len(self._fails)
+
+
+def workload(limiter, keys, ops, seed):
+    rng = random.Random(seed)
+    for _ in range(ops):
+        ip = keys[rng.randrange(len(keys))]
+        r = rng.random()
+        if r < 0.80:
+            limiter.allow(f'access:{ip}', 30, 60)
+        elif r < 0.97:
+            limiter.locked_out(f'totp:board:{ip}', 5, 300)
+        else:
+            limiter.record_failure(f'totp:board:{ip}')
+
+
+def run(factory, threads, ops, keys):
+    limiter = factory()
+    per_thread = ops // threads
+    workers = [threading.Thread(target=workload, args=(limiter, keys, per_thread, i))
+               for i in range(threads)]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+    return per_thread * threads / elapsed
+
+
+def memory_per_key(factory, keys, events_per_key):
+    '''Bytes held per key after `events_per_key` allow() calls on each.'''
+    tracemalloc.start()
+    limiter = factory()
+    before = tracemalloc.get_traced_memory()[0]
+    for ip in keys:
+        for _ in range(events_per_key):
+            limiter.allow(f'access:{ip}', 10**9, 60)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(keys)
+
+
+def worst_call(factory, keys, probes=10_000):
+    '''Longest single allow() once `keys` are tracked and housekeeping is
+    due. For the deque baseline, that is the call that runs its periodic
+    sweep (every 10 minutes in production), which walks every key under the
+    global lock. The striped limiter never sweeps, so its worst call is
+    measured as the slowest of `probes` calls.'''
+    limiter = factory()
+    for ip in keys:
+        limiter.allow(f'access:{ip}', 30, 60)
+    if isinstance(limiter, DequeRateLimiter):
+        limiter._last_sweep = float('-inf')
+    worst = 0.0
+    for i in range(probes):
+        t0 = time.perf_counter()
+        limiter.allow(f'access:{keys[i % len(keys)]}', 30, 60)
+        worst = max(worst, time.perf_counter() - t0)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ops', type=int, default=200_000, help='operations per run')
+    parser.add_argument('--keys', type=int, default=50_000, help='distinct client IPs')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    keys = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(args.keys)]
+    impls = [('striped', RateLimiter), ('deque', DequeRateLimiter)]
+
+    print(f"{args.ops} ops per run over {args.keys} client keys (80% allow, 17% locked_out, 3% record_failure)")
+    print(f"{'threads':>8} " + ' '.join(f'{name + " ops/s":>16}' for name, _ in impls))
+    for n in args.threads:
+        row = [run(factory, n, args.ops, keys) for _, factory in impls]
+        print(f"{n:>8} " + ' '.join(f'{r:>16,.0f}' for r in row))
+
+    cells = ', '.join(f'{name} {worst_call(factory, keys) * 1000:.2f} ms' for name, factory in impls)
+    print(f"worst single call with {args.keys} keys tracked: {cells}")
+
+    sample = keys[:10_000]
+    for events in (1, 30):
+        cells = ', '.join(f'{name} {memory_per_key(factory, sample, events):,.0f} B'
+                          for name, factory in impls)
+        print(f"memory per key after {events} event(s): {cells}")
+
+
+if __name__ == '__main__':
+    main()
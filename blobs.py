@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+'''
+blobs.py — content-addressed, deduplicated file storage for wpaste (BLOB_STORE).
+
+Every uploaded file is still saved at its usual path in the board's directory
+(<base_dir>/<date>/<id>.<ext>, which the index row points to and which is what
+gets served). With the blob store on, that file is also hard-linked as
+    BLOBS_DIR/<first two hex digits>/<sha256>
+and when the same content arrives again, the new message's file becomes
+another link to that same inode instead of a second copy. The inode's link
+count is the reference count:
+  - deleting a message, purging it, or removing a whole board unlinks the
+    message's file, which drops one reference;
+  - a blob whose only remaining link is its store entry (st_nlink == 1) is
+    unreferenced. The index row records the sha256, so release(digest) checks
+    and removes just that blob when its message goes; collect() sweeps the
+    whole store once at startup, for what a crash (or a row from before the
+    column) left behind.
+Links live in the filesystem, so this is shared by all workers without locks,
+survives restarts, and a message's data stays readable even if its blob entry
+is collected at the worst possible moment: the message's own link keeps the
+inode alive. BLOBS_DIR must be on the same filesystem as the board
+directories, since hard links cannot cross filesystems.
+'''
+import os
+import re
+import hashlib
+import threading
+
+# print with flush on, matching app.py's convention.
+from functools import partial
+print = partial(print, flush=True)
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    '''sha256 hex digest of a file on disk.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for data in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    '''Deduplicate saved files by sha256; see the module docstring.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.dedup_hits = 0
+        self.bytes_saved = 0
+        # Store-wide totals as of the startup collect() scan, plus what this
+        # process stored and released since; stats() reads these rather than
+        # walking the store.
+        self.blobs = 0
+        self.blob_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._link_error = None
+        os.makedirs(root, exist_ok=True)
+
+    def path_of(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def intern(self, path, digest):
+        '''Store the freshly written file at `path`, whose content hashes to
+        `digest`. If that content is already stored, `path` is replaced by a
+        link to the stored copy and True is returned; otherwise `path` becomes
+        the stored copy and False is returned.'''
+        blob = self.path_of(digest)
+        tmp = f'{path}.link'
+        try:
+            for _ in range(2):
+                try:
+                    os.link(blob, tmp)
+                except FileNotFoundError:
+                    pass                    # new content, or its blob was just collected
+                else:
+                    size = os.path.getsize(path)
+                    os.replace(tmp, path)   # drop the new copy, keep the stored one
+                    with self._lock:
+                        self.dedup_hits += 1
+                        self.bytes_saved += size
+                    return True
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    os.link(path, blob)
+                    size = os.path.getsize(path)
+                    with self._lock:
+                        self.blobs += 1
+                        self.blob_bytes += size
+                    return False
+                except FileExistsError:
+                    continue                # stored by a concurrent request; link to it
+        except OSError as e:
+            # e.g. BLOBS_DIR on another filesystem: keep the plain file.
+            if self._link_error is None:
+                self._link_error = e
+                print(f"Blob store: cannot link into {self.root} ({e}); storing files without dedup")
+        return False
+
+    def release(self, digest):
+        '''Called once a message file holding the content `digest` has been
+        unlinked: remove that blob if nothing else links to it now. True if
+        it was removed.'''
+        if not _DIGEST_RE.match(digest or ''):
+            return False
+        blob = self.path_of(digest)
+        try:
+            st = os.stat(blob)
+            if st.st_nlink != 1:
+                return False
+            os.remove(blob)
+        except FileNotFoundError:
+            return False                    # never stored, or released by another worker
+        with self._lock:
+            self.blobs -= 1
+            self.blob_bytes -= st.st_size
+        return True
+
+    def collect(self):
+        '''Remove every blob nothing links to any more; return how many. The
+        blobs kept are counted on the way, for stats(). This walks the whole
+        store, so it only runs at startup.'''
+        removed = blobs = size = 0
+        for sub in os.listdir(self.root):
+            subdir = os.path.join(self.root, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not _DIGEST_RE.match(name):
+                    continue
+                blob = os.path.join(subdir, name)
+                try:
+                    st = os.stat(blob)
+                    if st.st_nlink == 1:
+                        os.remove(blob)
+                        removed += 1
+                    else:
+                        blobs += 1
+                        size += st.st_size
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self.blobs, self.blob_bytes = blobs, size
+        return removed
+
+    def stats(self):
+        '''Store-wide blob count/bytes (as of the startup collection, plus
+        what this process stored and released since) and this process's dedup
+        counters.'''
+        with self._lock:
+            return {"blobs": self.blobs, "bytes": self.blob_bytes,
+                    "dedup_hits": self.dedup_hits, "bytes_saved": self.bytes_saved}
+
+    def start(self):
+        '''Sweep leftovers from before a restart, in the background.'''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wpaste-blob-collector', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            removed = self.collect()
+            if removed:
+                print(f"Blob store: removed {removed} unreferenced blob(s)")
+        except Exception as e:
+            print(f"Blob store: collection failed: {e}")
@@ -4,10 +4,13 @@ boards.py — named, TOTP-authenticated boards for wpaste.
 
 This module owns everything that the single global board in app.py does NOT:
 the board registry, per-board message indexes, TOTP secrets, session tokens,
-permission decisions, and a tiny in-memory rate limiter. app.py stays thin
-routing and delegates here.
+permission decisions, a tiny in-memory rate limiter, the text-body cache and
+the background retention reaper, the bounded pool of open board indexes,
+plus the shared clock table that lets several worker processes serve the
+same boards. app.py stays thin routing and delegates here.
 
-Storage:
+Storage (tables go through storage.open_table, so with INDEX_BACKEND=sqlite
+each .tsv/.nsv below is a .sqlite3 database instead):
   - boards.nsv            TSVZ registry (null-separated), keyed by canonical slug.
   - boards/<slug>/index.tsv   per-board TSVZ message index (same shape as the
                               default board's mainIndex.tsv).
@@ -22,15 +25,28 @@ INCLUDES the key at element [0], but writes assign only the trailing columns):
 '''
 import os
 import re
+import mmap
 import time
+import zlib
+import struct
+import bisect
 import shutil
 import secrets
+import hmac
+import heapq
+import itertools
 import threading
-from collections import deque
+from contextlib import contextmanager, nullcontext
+from collections import deque, OrderedDict, namedtuple
+try:
+    import fcntl
+except ImportError:           # Windows: no flock, so multi-worker mode is POSIX-only
+    fcntl = None
 
-import TSVZ
 import pyotp
 
+from storage import open_table, file_lock
+
 # print with flush on, matching app.py's convention.
 from functools import partial
 print = partial(print, flush=True)
@@ -102,74 +118,330 @@ def verify_code(secret, code):
         return False
 
 
+class TOTPCache:
+    '''verify_code() for known boards, without re-deriving codes per request.
+
+    The codes verify_code accepts (previous, current and next 30s step) only
+    change when the step rolls over, so each board's three are computed once
+    per step and kept as (secret, step, codes). An entry is recomputed when
+    the step moves or the board's secret differs from the one it was built
+    from (regen_secret, possibly in another worker), and dropped with
+    forget(). A candidate code is compared against all three with
+    hmac.compare_digest, so timing reveals neither which one matched nor how
+    much of it did. Failures still go through the caller's lockout.'''
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self._entries = {}        # slug -> (secret, step, codes)
+
+    def verify(self, slug, secret, code, now=None):
+        if not secret or not code:
+            return False
+        now = time.time() if now is None else now
+        step = int(now // self.interval)
+        entry = self._entries.get(slug)
+        if entry is None or entry[0] != secret or entry[1] != step:
+            try:
+                totp = pyotp.TOTP(secret, interval=self.interval)
+                base = step * self.interval
+                codes = tuple(totp.at(base, offset) for offset in (-1, 0, 1))
+            except Exception:
+                return False
+            entry = (secret, step, codes)
+            self._entries[slug] = entry
+        candidate = str(code).strip().encode()
+        matched = False
+        for valid in entry[2]:
+            matched |= hmac.compare_digest(valid.encode(), candidate)
+        return matched
+
+    def forget(self, slug):
+        self._entries.pop(slug, None)
+
+
 # ---------------------------------------------------------------------------
-# Rate limiter — in-memory, single-process (wpaste runs one worker).
+# Rate limiter — in-memory, per process.
 # ---------------------------------------------------------------------------
 class RateLimiter:
-    '''Sliding-window event throttle plus failure-based lockout. Keys are
-    client-derived (IP, board slug), so they must not accumulate forever: each
-    op drops its key when its deque empties, and a periodic sweep reaps keys
-    that were touched once and abandoned.'''
-    def __init__(self, sweep_interval=600.0):
-        self._events = {}    # key -> deque[timestamps]
-        self._fails = {}     # key -> deque[timestamps]
-        self._lock = threading.Lock()
-        self._max_window = 0.0          # widest window seen, for the sweep horizon
-        self._sweep_interval = sweep_interval
-        self._last_sweep = time.monotonic()
+    '''Sliding-window event throttle plus failure-based lockout, in O(1)
+    memory per key.
 
-    def _sweep(self, now):
-        '''Drop keys whose newest timestamp is older than any live window.'''
-        if now - self._last_sweep < self._sweep_interval:
-            return
-        self._last_sweep = now
-        for store in (self._events, self._fails):
-            for k in list(store):
-                dq = store[k]
-                while dq and now - dq[0] > self._max_window:
-                    dq.popleft()
-                if not dq:
-                    del store[k]
+    Each key holds a sliding-window counter, [window, start, prev, cur,
+    touched], instead of one timestamp per event: `cur` counts events in the
+    fixed window that began at `start`, `prev` those in the window before,
+    and the trailing-window count is estimated as
+        prev * (1 - (now - start) / window) + cur,
+    the usual approximation, exact when events are evenly spread.
+
+    Keys are client-derived (IP, board slug), so they must not accumulate:
+    keys are spread over `stripes` independently locked shards, each kept in
+    least-recently-touched order, and every operation on a shard first drops
+    the stale keys at its front (those whose counts have fully decayed), so
+    expiry is incremental and no request ever waits on a full sweep.'''
+
+    def __init__(self, stripes=64):
+        stripes = 1 << max(0, int(stripes) - 1).bit_length()     # power of two
+        self._mask = stripes - 1
+        self._stripes = [(threading.Lock(), OrderedDict(), OrderedDict())
+                         for _ in range(stripes)]       # (lock, events, fails)
+        self._fail_window = 0.0      # widest lockout window seen; used by record_failure
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) & self._mask]
+
+    @staticmethod
+    def _expire(store, now):
+        '''Under the stripe lock: drop fully decayed keys from the front.'''
+        while store:
+            entry = store[next(iter(store))]
+            if now - entry[4] < 2 * entry[0]:
+                return
+            store.popitem(last=False)
+
+    @staticmethod
+    def _touch(store, key, window, now):
+        '''Under the stripe lock: the key's counter, rolled forward to `now`.'''
+        entry = store.get(key)
+        if entry is None:
+            entry = store[key] = [window, now, 0, 0, now]
+            return entry
+        store.move_to_end(key)
+        entry[0] = window
+        elapsed = now - entry[1]
+        if elapsed >= window:
+            if elapsed >= 2 * window:                  # both windows empty
+                entry[1], entry[2], entry[3] = now, 0, 0
+            else:                                      # slide by one window
+                entry[1], entry[2], entry[3] = entry[1] + window, entry[3], 0
+        entry[4] = now
+        return entry
+
+    @staticmethod
+    def _count(entry, now):
+        prev = entry[2]
+        if not prev:
+            return entry[3]
+        return prev * max(0.0, 1.0 - (now - entry[1]) / entry[0]) + entry[3]
 
     def allow(self, key, max_events, window):
         '''Record an event for `key`; return False if it exceeds `max_events`
         within the trailing `window` seconds.'''
         now = time.monotonic()
-        with self._lock:
-            self._max_window = max(self._max_window, window)
-            self._sweep(now)
-            dq = self._events.setdefault(key, deque())
-            while dq and now - dq[0] > window:
-                dq.popleft()
-            if len(dq) >= max_events:
+        lock, events, _fails = self._stripes[hash(key) & self._mask]
+        with lock:
+            # The hot path, so _expire/_touch/_count are inlined here.
+            for oldest in events.values():
+                if now - oldest[4] >= 2 * oldest[0]:
+                    self._expire(events, now)
+                break
+            entry = events.get(key)
+            if entry is None:
+                events[key] = [window, now, 0, 1, now]
+                return max_events > 0
+            events.move_to_end(key)
+            entry[0] = window
+            elapsed = now - entry[1]
+            if elapsed >= window:
+                if elapsed >= 2 * window:
+                    entry[1], entry[2], entry[3] = now, 0, 0
+                else:
+                    entry[1], entry[2], entry[3] = entry[1] + window, entry[3], 0
+            entry[4] = now
+            prev = entry[2]
+            count = entry[3] + (prev * max(0.0, 1.0 - (now - entry[1]) / window) if prev else 0)
+            if count >= max_events:
                 return False
-            dq.append(now)
+            entry[3] += 1
             return True
 
-    def record_failure(self, key):
+    def record_failure(self, key, window=None):
         now = time.monotonic()
-        with self._lock:
-            self._sweep(now)
-            self._fails.setdefault(key, deque()).append(now)
+        lock, _events, fails = self._stripe(key)
+        with lock:
+            self._expire(fails, now)
+            current = fails.get(key)
+            window = window or (current[0] if current else self._fail_window) or 300.0
+            self._touch(fails, key, window, now)[3] += 1
 
     def locked_out(self, key, max_fails, window):
         '''True if `key` has at least `max_fails` failures in the trailing
         `window` seconds.'''
         now = time.monotonic()
-        with self._lock:
-            self._max_window = max(self._max_window, window)
-            self._sweep(now)
-            dq = self._fails.setdefault(key, deque())
-            while dq and now - dq[0] > window:
-                dq.popleft()
-            locked = len(dq) >= max_fails
-            if not dq:                  # don't leave an empty key behind
-                del self._fails[key]
-            return locked
+        self._fail_window = max(self._fail_window, window)
+        lock, _events, fails = self._stripe(key)
+        with lock:
+            self._expire(fails, now)
+            if key not in fails:                # don't create state for clean keys
+                return False
+            return self._count(self._touch(fails, key, window, now), now) >= max_fails
 
     def clear_failures(self, key):
+        lock, _events, fails = self._stripe(key)
+        with lock:
+            fails.pop(key, None)
+
+    def __len__(self):
+        '''Keys currently tracked (events + failures), for monitoring.'''
+        return sum(len(events) + len(fails) for _lock, events, fails in self._stripes)
+
+
+# ---------------------------------------------------------------------------
+# Cross-process coordination (multi-worker mode)
+# ---------------------------------------------------------------------------
+REGISTRY_CLOCK = object()             # SharedClocks key for the board registry
+
+class SharedClocks:
+    '''Update clocks shared by every worker through a memory-mapped file of
+    `slots` little-endian uint64 counters. Slot 0 is the registry, slot 1 the
+    default board; named boards hash onto the rest. Two boards sharing a slot
+    only cost each other a spurious refresh.'''
+    def __init__(self, path, slots=4096):
+        if fcntl is None:
+            raise RuntimeError('MULTI_WORKER needs flock (a POSIX system)')
+        self.slots = max(3, int(slots))
+        size = self.slots * 8
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        # flock is per open file description, so threads of this process
+        # serialize on their own lock first.
+        self._lock = threading.Lock()
+
+    def slot(self, key):
+        if key is REGISTRY_CLOCK:
+            return 0
+        if key is None:
+            return 1
+        return 2 + zlib.crc32(key.encode('utf-8')) % (self.slots - 2)
+
+    def read(self, slot):
         with self._lock:
-            self._fails.pop(key, None)
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return struct.unpack_from('<Q', self._mm, slot * 8)[0]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def advance(self, slot, at_least):
+        '''Move the clock to max(current + 1, at_least) and return it.'''
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = max(struct.unpack_from('<Q', self._mm, slot * 8)[0] + 1, at_least)
+                struct.pack_into('<Q', self._mm, slot * 8, value)
+                return value
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def sync_from_disk(table):
+    '''Flush a table's pending writes and reload it, so it reflects what
+    other worker processes have written.'''
+    table.flush()
+    table.reload()
+
+
+# ---------------------------------------------------------------------------
+# Text body cache — text pastes are immutable once written, so a body only
+# leaves the cache when its message is deleted or it is evicted for space.
+# ---------------------------------------------------------------------------
+class TextCache:
+    '''Byte-budgeted LRU of text message bodies keyed by (slug, message_id);
+    slug is None for the default board. Sizes are UTF-8 byte lengths.'''
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._items = OrderedDict()   # key -> (body, nbytes), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, body):
+        nbytes = len(body.encode('utf-8'))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (body, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, freed) = self._items.popitem(last=False)
+                self._bytes -= freed
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def discard_board(self, slug):
+        '''Drop every cached body of one board (delete_all / board removal).'''
+        with self._lock:
+            for key in [k for k in self._items if k[0] == slug]:
+                self._bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._items), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+# ---------------------------------------------------------------------------
+# Disk usage — bytes held per board and in total
+# ---------------------------------------------------------------------------
+class DiskUsage:
+    '''Bytes held by each board (slug None = default board) and by all of
+    them, as recorded in the size column of their indexes. BoardState keeps
+    its board's count current as messages come and go, so nothing is ever
+    recomputed by walking the disk; a board's count outlives its state being
+    closed by the pool. Per process: with MULTI_WORKER a worker sees another
+    worker's changes to a board when it next refreshes that board.'''
+    def __init__(self):
+        self._boards = {}             # slug -> bytes
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def set(self, slug, nbytes):
+        with self._lock:
+            self.total += nbytes - self._boards.get(slug, 0)
+            self._boards[slug] = nbytes
+
+    def add(self, slug, delta):
+        with self._lock:
+            self._boards[slug] = self._boards.get(slug, 0) + delta
+            self.total += delta
+
+    def get(self, slug):
+        '''The board's bytes, or None if it has not been counted yet.'''
+        return self._boards.get(slug)
+
+    def drop(self, slug):
+        with self._lock:
+            self.total -= self._boards.pop(slug, 0)
+
+    def stats(self):
+        with self._lock:
+            return {'bytes': self.total, 'boards_counted': len(self._boards)}
 
 
 # ---------------------------------------------------------------------------
@@ -177,92 +449,572 @@ class RateLimiter:
 # ---------------------------------------------------------------------------
 class BoardState:
     '''Holds a board's live index and its own update clock. Used for both the
-    default/root board (slug=None) and named boards.'''
-    def __init__(self, slug, index, base_dir):
+    default/root board (slug=None) and named boards.
+
+    Every bump() also appends (stamp, op, message_id) to a bounded changelog so
+    /messages?since=<last_update> can answer with just the delta. op is 'add',
+    'delete', 'clear' (delete_all) or None (settings/meta only). Long-polling
+    clients park in wait() and are woken by the same bump().
+
+    bump() also maintains a time-ordered timeline of (unix_time, id) beside the
+    TSVZ index, so page() can return the newest N (or N before a cursor)
+    without walking the whole index, and the board's byte count (`bytes`,
+    mirrored into `usage`, a DiskUsage) from the rows' size column.
+
+    With `clocks` (multi-worker mode) the update clock lives in SharedClocks:
+    index mutations run inside mutating() under a file lock, and refresh()
+    reloads the index when another worker has moved the clock. Deltas cannot
+    span another worker's changes, so such a refresh forces clients to resync.
+
+    Named boards live in Boards' pool and may be closed when idle: a thread
+    using one holds a pin() until it is done, and a state is only retired
+    (closed for good; the pool opens a fresh one next time) while unpinned.'''
+    def __init__(self, slug, index, base_dir, changelog_size=1024, clocks=None, lock_path=None,
+                 usage=None):
         self.slug = slug              # None for the default/root board
-        self.index = index            # TSVZ.TSVZed
+        self.index = index            # storage table (TSVZTable / SQLiteTable)
         self.base_dir = base_dir      # directory files are written under
+        self.clocks = clocks          # SharedClocks, or None for single-worker
+        self.lock_path = lock_path    # file lock guarding index mutations (multi-worker)
+        self.usage = usage            # DiskUsage shared by every board, or None
+        self._slot = clocks.slot(slug) if clocks is not None else None
+        self._mutate_lock = threading.Lock()
         self.last_update = time.time_ns()
+        if clocks is not None:
+            self.last_update = max(self.last_update, clocks.read(self._slot))
+        self._changes = deque(maxlen=max(1, int(changelog_size)))
+        # Oldest cursor the log can still answer: every change stamped after it
+        # is in _changes. Anything older needs a full resync.
+        self._log_floor = self.last_update
+        self._log_lock = threading.Lock()
+        self._changed = threading.Condition(self._log_lock)
+        self._times = {}              # id -> unix_time
+        self._timeline = []           # sorted [(unix_time, id)], oldest first
+        self._sizes = {}              # id -> bytes
+        self.bytes = 0                # sum of _sizes
+        self._rebuild_timeline()
+        self._pins = 0                # threads currently using this state
+        self._pin_lock = threading.Lock()
+        self.closed = False           # retired from the pool; never reopened
+        self._close_on_unpin = False  # close() came while pinned
+        self._then = None             # ... and what it asked to run after
+        self.last_used = time.monotonic()
 
-    def bump(self):
-        self.last_update = time.time_ns()
+    def pin(self):
+        '''Mark the state in use; False if it was already retired.'''
+        with self._pin_lock:
+            if self.closed:
+                return False
+            self._pins += 1
+            self.last_used = time.monotonic()
+            return True
+
+    def unpin(self):
+        with self._pin_lock:
+            self._pins -= 1
+            self.last_used = time.monotonic()
+            close = self._close_on_unpin and not self._pins
+            if close:
+                self._close_on_unpin = False
+        if close:
+            self._close_index(self._then)
+
+    @property
+    def pinned(self):
+        return self._pins > 0
+
+    def retire(self):
+        '''Mark the state closed unless it is pinned; True if it was.'''
+        with self._pin_lock:
+            if self._pins:
+                return False
+            self.closed = True
+            return True
+
+    def close(self, then=None):
+        '''Retire the state even if pinned, and close its index: now, or when
+        the last thread using it unpins. then(), if given, runs right after.'''
+        with self._pin_lock:
+            self.closed = True
+            if self._pins:
+                self._close_on_unpin, self._then = True, then
+                return
+        self._close_index(then)
+
+    def _close_index(self, then=None):
+        # Stops the index's append thread (TSVZ) after flushing pending rows.
+        try:
+            self.index.close()
+        except Exception:
+            pass
+        if then is not None:
+            then()
+
+    def _rebuild_timeline(self):
+        self._times.clear()
+        self._timeline.clear()
+        self._sizes.clear()
+        self.bytes = 0
+        for mid, row in list(self.index.items()):
+            self._track(mid, row)
+        if self.usage is not None:
+            self.usage.set(self.slug, self.bytes)
+
+    def _track(self, message_id, row=None):
+        '''Add one index row to the timeline; blank/partial (tombstone) rows
+        are skipped.'''
+        if row is None:
+            row = self.index[message_id] if message_id in self.index else None
+        try:
+            unix_time = float(row[1])
+        except (ValueError, TypeError, IndexError):
+            return
+        if message_id in self._times:
+            self._untrack(message_id)
+        self._times[message_id] = unix_time
+        bisect.insort(self._timeline, (unix_time, message_id))
+        try:
+            size = int(row[6])
+        except (ValueError, TypeError, IndexError):
+            size = 0                      # saved before sizes were recorded
+        self._sizes[message_id] = size
+        self.bytes += size
+
+    def _untrack(self, message_id):
+        unix_time = self._times.pop(message_id, None)
+        if unix_time is None:
+            return
+        i = bisect.bisect_left(self._timeline, (unix_time, message_id))
+        if i < len(self._timeline) and self._timeline[i][1] == message_id:
+            del self._timeline[i]
+        self.bytes -= self._sizes.pop(message_id, 0)
+
+    def bump(self, op=None, message_id=None):
+        self.bump_many(op, [message_id])
+
+    def bump_many(self, op, message_ids):
+        '''bump() for several messages (a batch delete): one clock step, and in
+        multi-worker mode one flush, for all of them.'''
+        with self._log_lock:
+            # Strictly increasing, so a cursor names exactly one point in the log.
+            stamp = max(time.time_ns(), self.last_update + 1)
+            if self.clocks is not None:
+                # Other workers reload on seeing the clock move, so the rows
+                # must be on disk before it does.
+                self.index.flush()
+                stamp = self.clocks.advance(self._slot, stamp)
+            before = self.bytes
+            if op == 'clear':
+                self._changes.clear()
+                self._log_floor = stamp
+                self._times.clear()
+                self._timeline.clear()
+                self._sizes.clear()
+                self.bytes = 0
+            else:
+                for message_id in message_ids:
+                    if op == 'add':
+                        self._track(message_id)
+                    elif op == 'delete':
+                        self._untrack(message_id)
+                    # Entries of one batch share a stamp: a cursor is either
+                    # before all of them or past all of them.
+                    if len(self._changes) == self._changes.maxlen:
+                        self._log_floor = self._changes[0][0]
+                    self._changes.append((stamp, op, message_id))
+            if self.usage is not None and self.bytes != before:
+                self.usage.add(self.slug, self.bytes - before)
+            self.last_update = stamp
+            self._changed.notify_all()
+
+    def refresh(self):
+        '''Multi-worker: if another worker moved this board's clock, reload the
+        index from disk. Costs one shared-memory read when nothing changed.'''
+        if self.clocks is None:
+            return
+        shared = self.clocks.read(self._slot)
+        if shared <= self.last_update:
+            return
+        with self._changed:
+            if shared <= self.last_update:
+                return
+            sync_from_disk(self.index)
+            self._rebuild_timeline()
+            self._changes.clear()
+            self._log_floor = shared
+            self.last_update = shared
+            self._changed.notify_all()
+
+    def mutating(self):
+        '''Context for an index read-modify-write. Multi-worker: serialize it
+        with every other worker and start from the current file.'''
+        if self.clocks is None:
+            return nullcontext()
+        return self._mutating()
+
+    @contextmanager
+    def _mutating(self):
+        with self._mutate_lock, file_lock(self.lock_path):
+            self.refresh()
+            yield
+
+    def wait(self, since, timeout):
+        '''Block until last_update differs from `since` or `timeout` seconds
+        pass; return the current last_update either way.'''
+        if self.clocks is None:
+            with self._changed:
+                self._changed.wait_for(lambda: self.last_update != since, timeout)
+                return self.last_update
+        # Another worker's bump can't notify us: re-check the shared clock
+        # every half second.
+        deadline = time.monotonic() + timeout
+        while True:
+            self.refresh()
+            with self._changed:
+                remaining = deadline - time.monotonic()
+                if self.last_update != since or remaining <= 0:
+                    return self.last_update
+                self._changed.wait(min(remaining, 0.5))
+
+    def page(self, before=None, limit=None, after=None):
+        '''Return (ids newest first, next): up to `limit` message ids older
+        than the (unix_time, id) cursor `before` (or the newest ones) and, with
+        `after`, posted later than that unix time; plus the cursor for the page
+        after, or None when nothing older (and still after `after`) remains.'''
+        with self._log_lock:
+            end = len(self._timeline) if before is None else bisect.bisect_left(self._timeline, before)
+            floor = 0 if after is None else bisect.bisect_right(self._timeline, (after, '\U0010ffff'))
+            start = floor if limit is None else max(floor, end - limit)
+            ids = [mid for _, mid in reversed(self._timeline[start:end])]
+            return ids, (self._timeline[start] if start > floor else None)
+
+    def oldest(self):
+        '''unix_time of the oldest message, or None if the board is empty.'''
+        with self._log_lock:
+            return self._timeline[0][0] if self._timeline else None
+
+    def expired(self, cutoff, limit):
+        '''Up to `limit` ids of the oldest messages posted before `cutoff`.'''
+        with self._log_lock:
+            end = min(bisect.bisect_left(self._timeline, (cutoff,)), limit)
+            return [mid for _, mid in self._timeline[:end]]
+
+    def changes_since(self, since):
+        '''Return (changes, cursor): the (stamp, op, message_id) entries newer
+        than `since` and the current last_update. changes is None when `since`
+        has fallen off the log (or comes from another process lifetime) and the
+        caller must resync from the full index.'''
+        with self._log_lock:
+            cursor = self.last_update
+            if since < self._log_floor or since > cursor:
+                return None, cursor
+            return [c for c in self._changes if c[0] > since], cursor
 
 
 # ---------------------------------------------------------------------------
 # Board manager — registry + named board states
 # ---------------------------------------------------------------------------
 REGISTRY_HEADER = ['slug', 'secret', 'perm', 'retention', 'tokens', 'created', 'display']
+INDEX_HEADER = ['id', 'unix_time', 'path', 'type', 'filename', 'mime', 'size', 'sha256']
+
+# A registry row, parsed once: perm validated, tokens split into their issue
+# order (oldest first) plus a frozenset for O(1) session checks.
+BoardInfo = namedtuple('BoardInfo', 'slug secret perm retention tokens token_set created display')
+
+def _live_rows(registry):
+    '''(slug, row) for every registered board. Some TSVZ versions reload a
+    deleted row's tombstone as a blank row; those are skipped.'''
+    return ((slug, row) for slug, row in registry.items() if row[1])
+
+def _parse_row(slug, row):
+    tokens = tuple(t for t in row[4].split(',') if t)
+    return BoardInfo(slug=slug, secret=row[1],
+                     perm=row[2] if row[2] in PERMS else DEFAULT_PERM,
+                     retention=row[3],        # '' = inherit site default, else seconds
+                     tokens=tokens, token_set=frozenset(tokens),
+                     created=row[5], display=row[6])
 
 class Boards:
+    COMPACT_MIN_TOMBSTONES = 64       # and at least as many as live boards
+
     def __init__(self, *, boards_dir, registry_file, max_sessions,
-                 index_rewrite_interval, rate_limiter):
+                 index_rewrite_interval, rate_limiter, changelog_size=1024,
+                 clocks=None, index_backend='tsvz', max_open=256, idle_time=600,
+                 usage=None):
         self.boards_dir = boards_dir
         self.max_sessions = int(max_sessions)
         self.index_rewrite_interval = int(index_rewrite_interval)
+        self.changelog_size = int(changelog_size)
+        self.clocks = clocks          # SharedClocks in multi-worker mode, else None
+        self.index_backend = index_backend
+        self.max_open = max(1, int(max_open))    # open board states kept (soft: pinned ones stay)
+        self.idle_time = idle_time    # close states unused this long (0 = only on pool pressure)
         self.rl = rate_limiter
+        self.usage = usage if usage is not None else DiskUsage()
         os.makedirs(boards_dir, exist_ok=True)
-        self.registry = TSVZ.TSVZed(registry_file, header=REGISTRY_HEADER,
-                                    rewrite_interval=self.index_rewrite_interval,
-                                    verbose=False)
-        self._states = {}             # slug -> BoardState
-        # Reentrant: mutators hold it across a read-modify-write AND call the
-        # readers below (which also take it), and readers must take it so they
-        # never observe the registry mid-rebuild in delete().
+        self.registry_file = registry_file
+        self.registry = open_table(registry_file, REGISTRY_HEADER, backend=index_backend,
+                                   rewrite_interval=self.index_rewrite_interval,
+                                   lock_path=f'{registry_file}.lock' if clocks is not None else None)
+        self._states = {}             # slug -> BoardState, at most max_open unpinned
+        self._removing = set()        # deleted boards whose directory goes at their last unpin
+        self.opened = 0               # pool counters, see pool_stats()
+        self.evictions = 0
+        self._tombstones = 0          # registry deletes since the last compaction
+        self._maintainer = None
+        self._wake = threading.Event()
+        # slug -> BoardInfo, kept in step with the registry by every write.
+        # Readers use only this, without the lock: entries are replaced whole
+        # (never edited) and a dict lookup is atomic, so a reader sees either
+        # the old or the new row, and never the registry mid-compaction.
+        self._view = {}
+        # Reentrant: mutators hold it across a read-modify-write and call the
+        # readers below. Readers no longer take it.
         self._lock = threading.RLock()
+        self._registry_lock_path = f'{registry_file}.lock'
+        self._registry_seen = clocks.read(clocks.slot(REGISTRY_CLOCK)) if clocks is not None else 0
+        self._mutation_depth = 0
+        self._totp = TOTPCache()
+        self._rebuild_view()
+
+    def _rebuild_view(self):
+        self._view = {slug: _parse_row(slug, row) for slug, row in _live_rows(self.registry)}
+
+    # --- multi-worker coordination -----------------------------------------
+    def _refresh_registry(self):
+        '''Under _lock. Multi-worker: reload the registry if another worker
+        changed it, and drop live states of boards it deleted.'''
+        if self.clocks is None:
+            return
+        shared = self.clocks.read(self.clocks.slot(REGISTRY_CLOCK))
+        if shared == self._registry_seen:
+            return
+        sync_from_disk(self.registry)
+        self._rebuild_view()
+        self._registry_seen = shared
+        for slug in [s for s in self._states if s not in self._view]:
+            self._close_state(slug)
+
+    def _sync(self):
+        '''Readers: the lock is only taken when another worker has published
+        a registry change since we last looked (one mmap read otherwise).'''
+        if self.clocks is None:
+            return
+        if self.clocks.read(self.clocks.slot(REGISTRY_CLOCK)) != self._registry_seen:
+            with self._lock:
+                self._refresh_registry()
+
+    @contextmanager
+    def _mutating(self):
+        '''A registry read-modify-write. Multi-worker: held under a file lock,
+        started from the current file, and published on the registry clock.'''
+        with self._lock:
+            if self.clocks is None or self._mutation_depth:
+                yield
+                return
+            with file_lock(self._registry_lock_path):
+                self._mutation_depth += 1
+                try:
+                    self._refresh_registry()
+                    yield
+                    self.registry.flush()
+                    self._registry_seen = self.clocks.advance(self.clocks.slot(REGISTRY_CLOCK), 0)
+                finally:
+                    self._mutation_depth -= 1
 
     # --- existence / metadata ---------------------------------------------
+    def lookup(self, slug):
+        '''The board's parsed registry row (a BoardInfo), or None. This is the
+        request path's one call per board: existence, perm, retention and
+        sessions in a single lookup.'''
+        self._sync()
+        return self._view.get(slug)
+
     def exists(self, slug):
-        with self._lock:
-            return slug in self.registry
+        return self.lookup(slug) is not None
 
     def list_boards(self):
-        with self._lock:
-            return [m for m in (self.meta(s) for s in list(self.registry)) if m]
+        self._sync()
+        return [self._meta(info) for info in list(self._view.values())]
 
     def meta(self, slug):
         '''Return {slug, secret, perm, retention, created, display} or None.'''
-        with self._lock:
-            row = self.registry[slug] if slug in self.registry else None
-            if row is None:
-                return None
-            return {
-                'slug': slug,
-                'secret': row[1],
-                'perm': row[2] if row[2] in PERMS else DEFAULT_PERM,
-                'retention': row[3],    # '' = inherit site default, else seconds
-                'created': row[5],
-                'display': row[6],
-            }
+        info = self.lookup(slug)
+        return self._meta(info) if info is not None else None
+
+    @staticmethod
+    def _meta(info):
+        return {'slug': info.slug, 'secret': info.secret, 'perm': info.perm,
+                'retention': info.retention, 'created': info.created,
+                'display': info.display}
 
     def _write_row(self, slug, *, secret, perm, retention, tokens, created, display):
         # tokens is a list[str]; store comma-joined (tokens are url-safe, no commas).
-        self.registry[slug] = [secret, perm, str(retention), ','.join(tokens),
-                               str(created), display]
+        row = [secret, perm, str(retention), ','.join(tokens), str(created), display]
+        self.registry[slug] = row
+        self._view[slug] = _parse_row(slug, [slug] + row)
 
     # --- per-board live state ---------------------------------------------
+    # Every board ever touched would otherwise keep its index (file handle and
+    # TSVZ append thread) open forever, so the pool holds at most max_open of
+    # them and closes the least recently used, plus any idle for idle_time.
+    # A closed board is reopened on next use; its clients simply resync.
     def state(self, slug):
-        '''Lazily create/load a named board's BoardState (index + base dir).'''
+        '''Lazily create/load a named board's BoardState (index + base dir).
+        Unpinned, so only for single-threaded use (the admin CLI); request and
+        background threads take one with pin() or using().'''
+        st = self._states.get(slug)       # fast path: already open
+        if st is not None and not st.closed:
+            st.last_used = time.monotonic()
+            return st
+        with self._lock:
+            return self._state(slug)
+
+    def pin(self, slug):
+        '''The board's BoardState, pinned open until a matching unpin().'''
+        while True:
+            st = self._states.get(slug)
+            if st is None or st.closed:
+                with self._lock:
+                    st = self._state(slug)
+            if st.pin():
+                return st
+            # Retired between the lookup and the pin: open a fresh one.
+
+    def unpin(self, st):
+        st.unpin()
+
+    @contextmanager
+    def using(self, slug):
+        st = self.pin(slug)
+        try:
+            yield st
+        finally:
+            st.unpin()
+
+    def _state(self, slug):
+        # Under _lock: request threads and the reaper may open the same board
+        # at once, and two TSVZ instances on one file would clobber each other.
         st = self._states.get(slug)
-        if st is None:
+        if st is None or st.closed:
+            self._shrink(self.max_open - 1)     # make room before opening
             base_dir = os.path.join(self.boards_dir, slug)
             os.makedirs(base_dir, exist_ok=True)
-            index = TSVZ.TSVZed(os.path.join(base_dir, 'index.tsv'),
-                                header=['id', 'unix_time', 'path', 'type', 'filename'],
-                                rewrite_interval=self.index_rewrite_interval,
-                                verbose=False)
-            st = BoardState(slug, index, base_dir)
+            index_file = os.path.join(base_dir, 'index.tsv')
+            index = open_table(index_file, INDEX_HEADER, backend=self.index_backend,
+                               rewrite_interval=self.index_rewrite_interval,
+                               lock_path=f'{index_file}.lock' if self.clocks is not None else None)
+            st = BoardState(slug, index, base_dir, changelog_size=self.changelog_size,
+                            clocks=self.clocks, lock_path=f'{index_file}.lock',
+                            usage=self.usage)
             self._states[slug] = st
+            self.opened += 1
         return st
 
+    def _shrink(self, limit, idle_before=None):
+        '''Under _lock: close unpinned states, least recently used first,
+        until at most `limit` are open, and with `idle_before` (a monotonic
+        time) also every one unused since before it.'''
+        excess = len(self._states) - limit
+        for st in sorted(self._states.values(), key=lambda s: s.last_used):
+            if excess <= 0 and (idle_before is None or st.last_used >= idle_before):
+                break
+            if st.retire():
+                self._close_state(st.slug)
+                self.evictions += 1
+                excess -= 1
+
+    def close_idle(self):
+        '''Close every unpinned board unused for idle_time; return how many.'''
+        if not self.idle_time:
+            return 0
+        with self._lock:
+            before = self.evictions
+            self._shrink(self.max_open, idle_before=time.monotonic() - self.idle_time)
+            return self.evictions - before
+
+    def usage_of(self, slug):
+        '''Bytes the board holds, counted from its index if not known yet.'''
+        nbytes = self.usage.get(slug)
+        if nbytes is None:
+            with self.using(slug):
+                pass
+            nbytes = self.usage.get(slug) or 0
+        return nbytes
+
+    def count_usage(self):
+        '''Count every board not counted yet, so usage.total covers them all.'''
+        for slug in list(self._view):
+            if self.usage.get(slug) is None:
+                self.usage_of(slug)
+
+    def pool_stats(self):
+        states = list(self._states.values())
+        return {'open': len(states), 'pinned': sum(st.pinned for st in states),
+                'max_open': self.max_open, 'opened': self.opened,
+                'evictions': self.evictions}
+
+    def _close_state(self, slug):
+        # Under _lock. Stop the per-board index's append thread before removing
+        # its file, or it errors flushing to a path that no longer exists. A
+        # state still pinned is retired now and closed by its last unpin().
+        st = self._states.pop(slug, None)
+        if st is not None:
+            st.close()
+
     # --- lifecycle ---------------------------------------------------------
+    def start(self):
+        '''Start the maintenance thread: it counts the disk usage of boards
+        not opened yet, then closes idle boards and compacts the registry
+        once deletes have left enough tombstones in it.'''
+        if self._maintainer is None:
+            self._maintainer = threading.Thread(target=self._run_maintenance, name='wpaste-boards', daemon=True)
+            self._maintainer.start()
+
+    def _run_maintenance(self):
+        interval = max(1, min(self.idle_time / 2, 60)) if self.idle_time else 60
+        try:
+            self.count_usage()            # boards untouched since startup
+        except Exception as e:
+            print(f"Board maintenance: counting usage: {e}")
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                closed = self.close_idle()
+                if closed:
+                    print(f"Closed {closed} idle board(s)")
+                if self._compaction_due():
+                    self.compact_registry()
+            except Exception as e:
+                print(f"Board maintenance: {e}")
+
+    def _compaction_due(self):
+        return self._tombstones >= max(self.COMPACT_MIN_TOMBSTONES, len(self._view))
+
+    def compact_registry(self):
+        '''Rewrite the registry file without its deleted rows. Holds the
+        registry lock (other mutators wait; lookups do not).'''
+        with self._mutating():
+            self.registry.compact()
+            dropped, self._tombstones = self._tombstones, 0
+        print(f"Compacted {self.registry_file}: dropped {dropped} deleted board(s)")
+
+    def close(self):
+        '''Flush and close the registry and every open board index.'''
+        with self._lock:
+            for slug in list(self._states):
+                self._close_state(slug)
+            self.registry.close()
+
     def create(self, slug, display, perm=DEFAULT_PERM, retention='', secret=None):
         '''Atomically register a NEW board and return its TOTP secret, or None if
         a board with this slug already exists. No session yet. Pass `secret` to
         commit a secret already shown to the user as a QR.'''
         secret = secret or new_secret()
-        with self._lock:
-            if slug in self.registry:
-                return None
+        with self._mutating():
+            if slug in self._view or slug in self._removing:
+                return None               # (or its deleted namesake is still in use)
             self._write_row(slug, secret=secret,
                             perm=perm if perm in PERMS else DEFAULT_PERM,
                             retention=retention, tokens=[],
@@ -274,7 +1026,7 @@ class Boards:
             return False
         # Read meta INSIDE the lock so the read-modify-write is atomic; reading
         # it outside lets a concurrent write (e.g. regen_secret) be clobbered.
-        with self._lock:
+        with self._mutating():
             m = self.meta(slug)
             if not m:
                 return False
@@ -284,7 +1036,7 @@ class Boards:
         return True
 
     def set_retention(self, slug, retention):
-        with self._lock:
+        with self._mutating():
             m = self.meta(slug)
             if not m:
                 return False
@@ -296,59 +1048,70 @@ class Boards:
     def regen_secret(self, slug):
         '''Admin: issue a fresh secret and invalidate every session.'''
         secret = new_secret()
-        with self._lock:
+        with self._mutating():
             m = self.meta(slug)
             if not m:
                 return None
             self._write_row(slug, secret=secret, perm=m['perm'],
                             retention=m['retention'], tokens=[],
                             created=m['created'], display=m['display'])
+        self._totp.forget(slug)
         return secret
 
-    def delete(self, slug):
+    def delete(self, slug, then=None):
         '''Remove a board: drop its registry row, files, and live state.
 
-        TSVZ in this version does not persist a single-key deletion across a
-        reload (the tombstone reloads as an empty row), so we rebuild the
-        registry from its surviving rows instead — reliable and cheap for the
-        modest number of boards.'''
-        existed = slug in self.registry
-        # Stop the per-board index's append thread before removing its file,
-        # or it errors flushing to a path that no longer exists.
-        st = self._states.pop(slug, None)
-        if st is not None:
-            try:
-                st.index.close()
-            except Exception:
-                pass
+        The row is deleted in place, O(1) on every backend (TSVZ appends a
+        tombstone line). The file is rewritten without tombstones later, by
+        compact_registry() on the maintenance thread. While threads still have
+        the board pinned, its directory stays (their index flushes into it)
+        and the slug cannot be created again; the last unpin removes it and
+        then runs then(), if given.'''
+        with self._mutating():
+            existed = slug in self._view
+            if existed:
+                del self.registry[slug]
+                self._view.pop(slug, None)
+                if not self.registry.persistent_deletes:
+                    self._tombstones += 1
         board_dir = os.path.join(self.boards_dir, slug)
-        if os.path.isdir(board_dir):
-            shutil.rmtree(board_dir, ignore_errors=True)
-        if existed:
-            with self._lock:
-                survivors = {k: list(self.registry[k][1:])
-                             for k in list(self.registry) if k != slug}
-                self.registry.clear()        # truncates the file
-                for k, trailing in survivors.items():
-                    self.registry[k] = trailing
+
+        def remove():
+            # Only once the index is closed: it flushes into this directory.
+            if os.path.isdir(board_dir):
+                shutil.rmtree(board_dir, ignore_errors=True)
+            self._removing.discard(slug)
+            if then is not None:
+                then()
+
+        with self._lock:
+            st = self._states.pop(slug, None)
+            if st is not None:
+                self._removing.add(slug)
+        self.usage.drop(slug)
+        self._totp.forget(slug)
+        if st is None:
+            remove()
+        else:
+            st.close(then=remove)
+        if existed and self._compaction_due():
+            self._wake.set()
         return existed
 
     # --- sessions / tokens -------------------------------------------------
     def _tokens(self, slug):
-        with self._lock:
-            row = self.registry[slug] if slug in self.registry else None
-            if row is None:
-                return []
-            return [t for t in row[4].split(',') if t]
+        info = self.lookup(slug)
+        return list(info.tokens) if info is not None else []
 
     def valid_token(self, slug, token):
-        return bool(token) and token in self._tokens(slug)
+        info = self.lookup(slug)
+        return bool(token) and info is not None and token in info.token_set
 
     def issue_token(self, slug):
         '''Create a new session token, evict the oldest beyond max_sessions,
         persist, and return it. Returns None if the board is gone.'''
         token = secrets.token_urlsafe(18)
-        with self._lock:
+        with self._mutating():
             m = self.meta(slug)
             if not m:
                 return None
@@ -360,7 +1123,7 @@ class Boards:
         return token
 
     def revoke_token(self, slug, token):
-        with self._lock:
+        with self._mutating():
             m = self.meta(slug)
             if not m:
                 return
@@ -371,5 +1134,112 @@ class Boards:
 
     # --- totp --------------------------------------------------------------
     def verify(self, slug, code):
-        m = self.meta(slug)
-        return bool(m) and verify_code(m['secret'], code)
+        info = self.lookup(slug)
+        return info is not None and self._totp.verify(slug, info.secret, code)
+
+
+# ---------------------------------------------------------------------------
+# Retention reaper — purges expired messages off the request path
+# ---------------------------------------------------------------------------
+class Reaper:
+    '''Background thread that enforces retention for every board.
+
+    It keeps a heap of (due, seq, slug): when each board's oldest message
+    expires. A due board is opened, purged oldest-first in batches of `batch`,
+    and re-queued for when its new oldest message expires. Posting and
+    retention changes call schedule(); an entry later than one already queued
+    for the board is ignored, so a busy board costs a dict lookup per post.
+    Listings hand over rows they found broken (file gone, blank tombstone)
+    with purge_soon(), whatever the board's retention.
+
+    Collaborators are injected so this module needn't know app.py's storage:
+      retention_of(slug) -> seconds (0 = never)
+      state_of(slug)     -> context manager yielding the BoardState (kept open
+                            meanwhile), or None if the board no longer exists
+      purge(state, id)   -> delete one message (files, index, caches, clock)
+    '''
+    def __init__(self, *, retention_of, state_of, purge, batch=500):
+        self.retention_of = retention_of
+        self.state_of = state_of
+        self.purge = purge
+        self.batch = max(1, int(batch))
+        self._heap = []               # (due, seq, slug); seq breaks ties (slug may be None)
+        self._due = {}                # slug -> earliest queued due time
+        self._stale = {}              # slug -> ids to purge on its next visit
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._thread = None
+
+    def schedule(self, slug, when):
+        '''Make sure `slug` is looked at no later than `when` (unix time).'''
+        with self._cv:
+            due = self._due.get(slug)
+            if due is not None and due <= when:
+                return
+            self._due[slug] = when
+            heapq.heappush(self._heap, (when, next(self._seq), slug))
+            if self._heap[0][2] == slug:
+                self._cv.notify()
+
+    def purge_soon(self, slug, ids):
+        '''Have the thread purge `ids` from `slug` now, retention or not.'''
+        with self._cv:
+            self._stale.setdefault(slug, set()).update(ids)
+        self.schedule(slug, 0)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wpaste-reaper', daemon=True)
+            self._thread.start()
+
+    def _next_due(self):
+        '''Block until a board is due; pop and return its slug.'''
+        with self._cv:
+            while True:
+                if self._heap:
+                    when, _, slug = self._heap[0]
+                    if self._due.get(slug) != when:     # superseded by an earlier schedule()
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = when - time.time()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        del self._due[slug]
+                        return slug
+                    self._cv.wait(delay)
+                else:
+                    self._cv.wait()
+
+    def _run(self):
+        while True:
+            slug = self._next_due()
+            try:
+                self._reap(slug)
+            except Exception as e:
+                # e.g. the board was deleted mid-purge; its next post reschedules it.
+                print(f"Reaper: error purging board {slug!r}: {e}")
+
+    def _reap(self, slug):
+        with self._cv:
+            stale = self._stale.pop(slug, ())
+        retention = self.retention_of(slug)
+        if not retention and not stale:
+            return
+        with self.state_of(slug) as state:
+            if state is None:
+                return
+            for mid in stale:
+                self.purge(state, mid)
+            if not retention:
+                return
+            cutoff = time.time() - retention
+            while True:
+                ids = state.expired(cutoff, self.batch)
+                for mid in ids:
+                    self.purge(state, mid)
+                if len(ids) < self.batch:
+                    break
+                time.sleep(0)         # let request threads in between batches
+            oldest = state.oldest()
+        if oldest is not None:
+            self.schedule(slug, oldest + retention)
@@ -6,13 +6,20 @@
 #   - clients polling worker B never see messages posted to worker A, and
 #   - multiple processes writing the same mainIndex.tsv can clobber each other.
 #
-# It must therefore run as a SINGLE worker. Use threads (not workers) for
-# concurrency. Gunicorn auto-loads this file when run from this directory:
+# By default it must therefore run as a SINGLE worker. Use threads (not
+# workers) for concurrency. Gunicorn auto-loads this file when run from this
+# directory:
 #     gunicorn app:app
 #
-# If you ever need multiple workers, the shared state must first be moved out
-# of process (e.g. a shared store), otherwise updates and the index will break.
+# To run several workers, first set "MULTI_WORKER": true in the wpaste config.
+# The update clocks then move into a shared memory-mapped file and index writes
+# take file locks, so raising `workers` below is safe. Leave preload_app off:
+# each worker must open its own indexes.
+#
+# Every open tab parks one /last-update long-poll on a thread. wpaste caps the
+# parked ones at LONGPOLL_MAX_WAITERS (default 8), so keep `threads` comfortably
+# above that cap or normal requests will queue behind idle long-polls.
 
 workers = 1
-threads = 4
+threads = 16
 bind = "127.0.0.1:8000"
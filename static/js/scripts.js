@@ -33,34 +33,50 @@ function esc(s) {
 }
 
 // ===========================================================================
-// Live updates (poll the board's own update clock).
+// Live updates. /last-update?since=<clock> is a long-poll: the server parks
+// the request until the board's clock moves (or its timeout passes), so we can
+// re-ask straight away. If it declines to park (too many waiters), fall back
+// to polling every few seconds.
 // ===========================================================================
 let lastKnownUpdate = 0;
-let pollTimer = null;
+let polling = true;
+const POLL_FALLBACK_MS = 5000;
 
 function stopPolling() {
-	if (pollTimer) { clearInterval(pollTimer); pollTimer = null; }
+	polling = false;
 }
 
-async function checkForUpdates() {
+// Returns true when it is fine to ask again immediately (the server parked us,
+// or something changed), false when the caller should back off.
+async function checkForUpdates(wait) {
 	let response;
 	try {
-		response = await fetch(api('/last-update'));
+		response = await fetch(api('/last-update') + (wait ? `?since=${lastKnownUpdate}` : ''));
 	} catch (e) {
-		return;
+		return false;
 	}
 	if (response.status === 401) {   // private board, not authed
 		BOARD_LOCKED = true;
 		stopPolling();               // don't keep hammering a board we can't read
 		renderLocked();
-		return;
+		return false;
 	}
-	if (!response.ok) return;
+	if (!response.ok) return false;
 	const data = await response.json();
-	if (data.last_update > lastKnownUpdate) {
+	if (data.last_update !== lastKnownUpdate) {
 		lastKnownUpdate = data.last_update;
 		fetchMessages();
 		pulseLive();
+		return true;
+	}
+	return !!data.parked;
+}
+
+async function pollLoop() {
+	while (polling) {
+		if (!(await checkForUpdates(true))) {
+			await new Promise((resolve) => setTimeout(resolve, POLL_FALLBACK_MS));
+		}
 	}
 }
 
@@ -72,63 +88,164 @@ function pulseLive() {
 	el.classList.add('pulse');
 }
 
-pollTimer = setInterval(checkForUpdates, 5000);
-
 // ===========================================================================
 // Compose / upload
 // ===========================================================================
+// Files at least this big go through the resumable upload API (/uploads):
+// sent as chunks, CHUNK_PARALLEL at a time, each retried on failure, so a
+// dropped connection costs a chunk rather than the whole file. Picking the
+// same file again after a reload resumes where it stopped.
+const CHUNKED_UPLOAD_THRESHOLD = 64 * 1024 * 1024;
+const CHUNK_PARALLEL = 3;
+const CHUNK_RETRIES = 5;
+
+class UploadError extends Error {
+	constructor(message, status) { super(message); this.status = status; }
+}
+
+async function uploadJSON(url, options) {
+	const r = await fetch(url, options);
+	let body = null;
+	try { body = await r.json(); } catch (e) { /* not JSON */ }
+	if (!r.ok || !body || !body.success) {
+		throw new UploadError((body && body.message) || `HTTP ${r.status}`, r.ok ? 0 : r.status);
+	}
+	return body;
+}
+
+// Upload one file through /uploads; onProgress(bytesDone) as chunks land.
+async function uploadChunked(field, file, onProgress) {
+	const key = `wpaste-upload:${BOARD}:${field}:${file.name}:${file.size}:${file.lastModified}`;
+	let upload = null;
+	const previous = localStorage.getItem(key);
+	if (previous) {
+		try {
+			upload = await uploadJSON(api(`/uploads/${previous}`));
+		} catch (e) {
+			localStorage.removeItem(key);      // expired or gone: start over
+		}
+	}
+	if (!upload) {
+		upload = await uploadJSON(api('/uploads'), {
+			method: 'POST',
+			headers: { 'Content-Type': 'application/json' },
+			body: JSON.stringify({ type: field, filename: file.name, size: file.size }),
+		});
+		localStorage.setItem(key, upload.upload_id);
+	}
+	const url = api(`/uploads/${upload.upload_id}`);
+	const pending = upload.missing.slice();
+	let done = file.size - pending.reduce((n, off) => n + Math.min(upload.chunk_size, file.size - off), 0);
+	onProgress(done);
+
+	async function sendChunk(offset) {
+		const blob = file.slice(offset, offset + upload.chunk_size);
+		for (let attempt = 0; ; attempt++) {
+			try {
+				await uploadJSON(`${url}?offset=${offset}`, { method: 'PUT', body: blob });
+				done += blob.size;
+				onProgress(done);
+				return;
+			} catch (e) {
+				// 4xx other than a timeout won't get better by retrying.
+				if (attempt >= CHUNK_RETRIES || (e.status >= 400 && e.status < 500 && e.status !== 408)) throw e;
+			}
+			await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+		}
+	}
+	async function worker() {
+		while (pending.length) await sendChunk(pending.shift());
+	}
+	await Promise.all(Array.from({ length: CHUNK_PARALLEL }, worker));
+	await uploadJSON(`${url}/finish`, { method: 'POST' });
+	localStorage.removeItem(key);
+}
+
+function setUploadProgress(fraction) {
+	const uploadProgress = document.getElementById('uploadProgress');
+	uploadProgress.textContent = `${(fraction * 100).toFixed(0)}%`;
+	uploadProgress.className = 'uploading';
+	document.getElementById('progressBar').style.width = `${fraction * 100}%`;
+}
+
+// Upload the compose form's small files and text as one multipart POST;
+// resolves with the HTTP status.
+function postWithProgress(formData, onProgress) {
+	return new Promise(function(resolve) {
+		const xhr = new XMLHttpRequest();
+		xhr.open('POST', api('/message'), true);
+		xhr.upload.addEventListener('progress', function(e) {
+			if (e.lengthComputable) onProgress(e.loaded / e.total);
+		});
+		xhr.onload = function() { resolve(xhr.status); };
+		xhr.onerror = function() { resolve(0); };
+		xhr.send(formData);
+	});
+}
+
 document.getElementById('messageForm').addEventListener('submit', async function(e) {
 	e.preventDefault();
 	const message = document.getElementById('message').value;
 	const formData = new FormData(this);
 	formData.append('message', message);
 
-	const xhr = new XMLHttpRequest();
-	xhr.open('POST', api('/message'), true);
+	// Pull the big files out of the form; they go through uploadChunked().
+	const big = [];
+	for (const field of ['image', 'video', 'file']) {
+		const small = [];
+		for (const f of formData.getAll(field)) {
+			if (f instanceof File && f.size >= CHUNKED_UPLOAD_THRESHOLD) big.push([field, f]);
+			else small.push(f);
+		}
+		formData.delete(field);
+		small.forEach(f => formData.append(field, f));
+	}
+	const bigBytes = big.reduce((n, [, f]) => n + f.size, 0);
 
 	const progress = document.getElementById('progress');
 	progress.classList.add('active');
 
-	xhr.upload.addEventListener('progress', function(e) {
-		if (e.lengthComputable) {
-			const percentComplete = (e.loaded / e.total) * 100;
-			const uploadProgress = document.getElementById('uploadProgress');
-			uploadProgress.textContent = `${percentComplete.toFixed(0)}%`;
-			uploadProgress.className = 'uploading';
-			document.getElementById('progressBar').style.width = `${percentComplete}%`;
-		}
-	});
-
-	xhr.onload = function() {
-		const uploadProgress = document.getElementById('uploadProgress');
-		if (xhr.status === 200) {
-			document.getElementById('messageForm').reset();
-			document.getElementById('message').value = '';
-			document.getElementById('image-name').textContent = '';
-			document.getElementById('video-name').textContent = '';
-			document.getElementById('file-name').textContent = '';
-			uploadProgress.textContent = 'Sent';
-			uploadProgress.className = 'upload-complete';
-			document.getElementById('progressBar').style.width = '100%';
-			checkForUpdates();
-		} else if (xhr.status === 401) {
-			uploadProgress.textContent = 'Login required';
-			uploadProgress.className = 'upload-failed';
-			document.getElementById('progressBar').style.width = '0%';
-			openLoginModal(BOARD, BOARD_DISPLAY);
-		} else {
-			uploadProgress.textContent = 'Upload failed';
-			uploadProgress.className = 'upload-failed';
-			document.getElementById('progressBar').style.width = '0%';
+	let status = 200;
+	try {
+		let sent = 0;
+		for (const [field, file] of big) {
+			await uploadChunked(field, file, done => setUploadProgress((sent + done) / bigBytes));
+			sent += file.size;
 		}
-		setTimeout(function() {
-			progress.classList.remove('active');
-			document.getElementById('progressBar').style.width = '0%';
-			uploadProgress.textContent = '';
-		}, 1500);
-	};
+	} catch (err) {
+		status = err.status || 0;
+		console.error('Upload failed:', err);
+	}
+	if (status === 200) {
+		status = await postWithProgress(formData, setUploadProgress);
+	}
 
-	xhr.send(formData);
+	const uploadProgress = document.getElementById('uploadProgress');
+	if (status === 200) {
+		document.getElementById('messageForm').reset();
+		document.getElementById('message').value = '';
+		document.getElementById('image-name').textContent = '';
+		document.getElementById('video-name').textContent = '';
+		document.getElementById('file-name').textContent = '';
+		uploadProgress.textContent = 'Sent';
+		uploadProgress.className = 'upload-complete';
+		document.getElementById('progressBar').style.width = '100%';
+		checkForUpdates();
+	} else if (status === 401) {
+		uploadProgress.textContent = 'Login required';
+		uploadProgress.className = 'upload-failed';
+		document.getElementById('progressBar').style.width = '0%';
+		openLoginModal(BOARD, BOARD_DISPLAY);
+	} else {
+		uploadProgress.textContent = 'Upload failed';
+		uploadProgress.className = 'upload-failed';
+		document.getElementById('progressBar').style.width = '0%';
+	}
+	setTimeout(function() {
+		progress.classList.remove('active');
+		document.getElementById('progressBar').style.width = '0%';
+		uploadProgress.textContent = '';
+	}, 1500);
 });
 
 document.getElementById('clearButton').addEventListener('click', function() {
@@ -200,15 +317,40 @@ function detectTextMode(content) {
 	return 'plain';
 }
 
+// Listings are incremental: after one full load we ask for ?since=<cursor> and
+// the server answers with just the added/deleted messages, or resync=true (a
+// full listing) when our cursor has fallen off its changelog.
+// Only the newest PAGE_SIZE messages come with a full load; older pages are
+// fetched with ?before=<next> as the user scrolls down.
+let messagesCursor = null;      // last_update of the listing on screen (null = need a full one)
+let fetchInFlight = false;
+let fetchAgain = false;
+const PAGE_SIZE = 50;
+let olderCursor = null;         // "next" from the server: where the next older page starts
+let olderInFlight = false;
+
 async function fetchMessages() {
+    if (fetchInFlight) { fetchAgain = true; return; }
+    fetchInFlight = true;
+    try {
+        await loadMessages();
+    } finally {
+        fetchInFlight = false;
+    }
+    if (fetchAgain) { fetchAgain = false; fetchMessages(); }
+}
+
+async function loadMessages() {
     let response;
+    const url = api('/messages') + `?limit=${PAGE_SIZE}` + (messagesCursor !== null ? `&since=${messagesCursor}` : '');
     try {
-        response = await fetch(api('/messages'));
+        response = await fetch(url);
     } catch (e) {
         return;
     }
     if (response.status === 401) {
         BOARD_LOCKED = true;
+        messagesCursor = null;
         stopPolling();
         renderLocked();
         return;
@@ -217,6 +359,7 @@ async function fetchMessages() {
     const result = await response.json();
 
     // Refresh board state from the response and re-skin the UI accordingly.
+    const wasDeletable = canDelete();
     BOARD_LOCKED = false;
     if (BOARD) {
         BOARD_PERM = result.perm || BOARD_PERM;
@@ -226,128 +369,247 @@ async function fetchMessages() {
     }
     applyPermUI();
 
+    // Delete buttons are baked into each message; re-render them all if that changed.
+    if (!result.resync && canDelete() !== wasDeletable) {
+        messagesCursor = null;
+        fetchAgain = true;
+        return;
+    }
+
     const messagesDiv = document.getElementById('messages');
-    messagesDiv.innerHTML = '';
+    if (result.resync) {
+        messagesDiv.innerHTML = '';
+        olderCursor = result.next;
+    }
+    (result.deleted || []).forEach((id) => {
+        const el = document.getElementById(`message-${id}`);
+        if (el) el.remove();
+    });
+    // Newest first: build in order, then put the whole batch on top.
+    const batch = document.createDocumentFragment();
+    result.messages.forEach((message) => {
+        if (!document.getElementById(`message-${message.id}`)) {
+            batch.appendChild(buildMessageElement(message));
+        }
+    });
+    messagesDiv.insertBefore(batch, messagesDiv.firstChild);
+    messagesCursor = result.last_update;
+    if (result.resync) maybeLoadOlder();
+}
 
+async function loadOlder() {
+    if (olderInFlight || olderCursor === null || BOARD_LOCKED) return;
+    olderInFlight = true;
+    const cursor = olderCursor;
+    let result = null;
+    try {
+        const response = await fetch(api('/messages') + `?limit=${PAGE_SIZE}&before=${encodeURIComponent(cursor)}`);
+        if (response.ok) result = await response.json();
+    } catch (e) {
+        // leave olderCursor alone; the next scroll retries
+    } finally {
+        olderInFlight = false;
+    }
+    // A resync while we were away replaced the listing; this page is stale.
+    if (!result || olderCursor !== cursor) return;
+    const messagesDiv = document.getElementById('messages');
     result.messages.forEach((message) => {
-        const messageElement = document.createElement('div');
-        messageElement.classList.add('message');
-        messageElement.id = `message-${message.id}`;
+        if (!document.getElementById(`message-${message.id}`)) {
+            messagesDiv.appendChild(buildMessageElement(message));
+        }
+    });
+    olderCursor = result.next;
+    maybeLoadOlder();
+}
 
-        let contentToCopy = null;
-        let contentElementRef = null;
+// Fetch the next older page once the bottom of the listing is near (or the
+// listing doesn't fill the window yet).
+function maybeLoadOlder() {
+    if (window.innerHeight + window.scrollY >= document.body.offsetHeight - 800) {
+        loadOlder();
+    }
+}
 
-        const contentContainer = document.createElement('div');
-        contentContainer.classList.add('content-container');
+window.addEventListener('scroll', maybeLoadOlder, { passive: true });
 
-        const textMode = message.type === 'text' ? detectTextMode(message.content) : 'plain';
+function formatBytes(n) {
+    const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    let i = 0;
+    while (n >= 1024 && i < units.length - 1) { n /= 1024; i++; }
+    return `${i ? n.toFixed(n < 10 ? 1 : 0) : n} ${units[i]}`;
+}
 
-        if (message.type === 'text') {
-            contentElementRef = buildTextElement(message.content, textMode);
-            contentContainer.appendChild(contentElementRef);
-            contentToCopy = contentElementRef;
+function buildMessageElement(message) {
+    const messageElement = document.createElement('div');
+    messageElement.classList.add('message');
+    messageElement.id = `message-${message.id}`;
 
-        } else if (message.type === 'image') {
-            if (message.filename && message.filename !== 'image.png') {
-                const imgName = document.createElement('p');
-                imgName.textContent = message.filename;
-                contentContainer.appendChild(imgName);
-            }
-            const img = document.createElement('img');
-            img.src = message.content;
-            img.style.maxWidth = '100%';
-            contentContainer.appendChild(img);
-            contentElementRef = img;
-            contentToCopy = img;
-
-        } else if (message.type === 'video') {
-            if (message.filename) {
-                const videoName = document.createElement('p');
-                videoName.textContent = message.filename;
-                contentContainer.appendChild(videoName);
-            }
-            const video = document.createElement('video');
-            video.src = message.content;
-            video.controls = true;
-            video.style.maxWidth = '100%';
-            contentContainer.appendChild(video);
-            contentElementRef = video;
-            contentToCopy = video;
-
-        } else if (message.type === 'file') {
-            const a = document.createElement('a');
-            a.href = message.content;
-            a.textContent = message.filename || 'Download File';
-            a.download = '';
-            contentContainer.appendChild(a);
-            contentElementRef = a;
-            contentToCopy = a;
+    let contentToCopy = null;
+    let contentElementRef = null;
+
+    const contentContainer = document.createElement('div');
+    contentContainer.classList.add('content-container');
+
+    const textMode = message.type === 'text' ? detectTextMode(message.content) : 'plain';
 
+    if (message.type === 'text') {
+        contentElementRef = buildTextElement(message.content, textMode);
+        if (message.truncated) {
+            contentElementRef.dataset.full = message.full;   // copy fetches the whole paste
+        }
+        contentContainer.appendChild(contentElementRef);
+        contentToCopy = contentElementRef;
+
+    } else if (message.type === 'image') {
+        if (message.filename && message.filename !== 'image.png') {
+            const imgName = document.createElement('p');
+            imgName.textContent = message.filename;
+            contentContainer.appendChild(imgName);
+        }
+        const img = document.createElement('img');
+        // Show the thumbnail; the original is opened on click and copied.
+        img.src = message.thumb || message.content;
+        img.dataset.full = message.content;
+        img.loading = 'lazy';
+        img.style.maxWidth = '100%';
+        if (message.thumb) {
+            const link = document.createElement('a');
+            link.href = message.content;
+            link.target = '_blank';
+            link.appendChild(img);
+            contentContainer.appendChild(link);
         } else {
-            console.error('Unknown message type:', message.type);
-            const pre = document.createElement('pre');
-            pre.textContent = 'Unknown message type';
-            contentContainer.appendChild(pre);
-            contentElementRef = pre;
-            contentToCopy = pre;
+            contentContainer.appendChild(img);
         }
-
-        messageElement.appendChild(contentContainer);
-
-        const meta = document.createElement('div');
-        meta.classList.add('message-meta');
-        const typeTag = document.createElement('span');
-        typeTag.classList.add('msg-type');
-        typeTag.textContent = message.type;
-        const timeTag = document.createElement('span');
-        timeTag.classList.add('msg-time');
-        const date = new Date(message.timestamp * 1000);
-        timeTag.textContent = date.toLocaleString([], { dateStyle: 'medium', timeStyle: 'short' });
-        meta.appendChild(typeTag);
-        meta.appendChild(timeTag);
-        messageElement.insertBefore(meta, messageElement.firstChild);
-
-        const buttonsContainer = document.createElement('div');
-        buttonsContainer.classList.add('buttons-container');
-
-        const copyButton = document.createElement('button');
-        copyButton.textContent = 'Copy';
-        copyButton.classList.add('copy-button');
-        copyButton.onclick = function() { copyToClipboard(contentToCopy); };
-        buttonsContainer.appendChild(copyButton);
-
-        // Only offer delete where the viewer is actually allowed to delete.
-        if (canDelete()) {
-            const deleteButton = document.createElement('button');
-            deleteButton.textContent = 'Delete';
-            deleteButton.classList.add('delete-button');
-            deleteButton.onclick = function() { deleteMessage(message.id); };
-            buttonsContainer.appendChild(deleteButton);
+        contentElementRef = img;
+        contentToCopy = img;
+
+    } else if (message.type === 'video') {
+        if (message.filename) {
+            const videoName = document.createElement('p');
+            videoName.textContent = message.filename;
+            contentContainer.appendChild(videoName);
         }
-
-        if (textMode !== 'plain') {
-            const showRawButton = document.createElement('button');
-            showRawButton.textContent = 'Show Raw';
-            showRawButton.classList.add('show-raw-button');
-            messageElement.setAttribute('data-show-raw', 'false');
-
-            showRawButton.onclick = function() {
-                const isCurrentlyRaw = (messageElement.getAttribute('data-show-raw') === 'true');
-                const newMode = isCurrentlyRaw ? textMode : 'plain';
-                const newElement = buildTextElement(message.content, newMode);
-                contentContainer.replaceChild(newElement, contentElementRef);
-                contentElementRef = newElement;
-                contentToCopy = newElement;
-                messageElement.setAttribute('data-show-raw', isCurrentlyRaw ? 'false' : 'true');
-                showRawButton.textContent = isCurrentlyRaw ? 'Show Raw' : 'Show Rendered';
-            };
-
-            buttonsContainer.appendChild(showRawButton);
+        const video = document.createElement('video');
+        video.src = message.content;
+        if (message.thumb) {
+            video.poster = message.thumb;     // 404 (no poster) until it is made
         }
+        video.controls = true;
+        video.style.maxWidth = '100%';
+        contentContainer.appendChild(video);
+        contentElementRef = video;
+        contentToCopy = video;
+
+    } else if (message.type === 'file') {
+        const a = document.createElement('a');
+        a.href = message.content;
+        a.textContent = message.filename || 'Download File';
+        a.download = '';
+        contentContainer.appendChild(a);
+        contentElementRef = a;
+        contentToCopy = a;
+
+    } else {
+        console.error('Unknown message type:', message.type);
+        const pre = document.createElement('pre');
+        pre.textContent = 'Unknown message type';
+        contentContainer.appendChild(pre);
+        contentElementRef = pre;
+        contentToCopy = pre;
+    }
 
-        messageElement.appendChild(buttonsContainer);
-        messagesDiv.appendChild(messageElement);
-    });
+    messageElement.appendChild(contentContainer);
+
+    const meta = document.createElement('div');
+    meta.classList.add('message-meta');
+    const typeTag = document.createElement('span');
+    typeTag.classList.add('msg-type');
+    typeTag.textContent = message.type;
+    const timeTag = document.createElement('span');
+    timeTag.classList.add('msg-time');
+    const date = new Date(message.timestamp * 1000);
+    timeTag.textContent = date.toLocaleString([], { dateStyle: 'medium', timeStyle: 'short' });
+    meta.appendChild(typeTag);
+    meta.appendChild(timeTag);
+    if (message.type !== 'text' && message.size != null) {
+        const sizeTag = document.createElement('span');
+        sizeTag.classList.add('msg-size');
+        sizeTag.textContent = formatBytes(message.size);
+        meta.appendChild(sizeTag);
+    }
+    messageElement.insertBefore(meta, messageElement.firstChild);
+
+    const buttonsContainer = document.createElement('div');
+    buttonsContainer.classList.add('buttons-container');
+
+    const copyButton = document.createElement('button');
+    copyButton.textContent = 'Copy';
+    copyButton.classList.add('copy-button');
+    copyButton.onclick = function() { copyToClipboard(contentToCopy); };
+    buttonsContainer.appendChild(copyButton);
+
+    // Only offer delete where the viewer is actually allowed to delete.
+    if (canDelete()) {
+        const deleteButton = document.createElement('button');
+        deleteButton.textContent = 'Delete';
+        deleteButton.classList.add('delete-button');
+        deleteButton.onclick = function() { deleteMessage(message.id); };
+        buttonsContainer.appendChild(deleteButton);
+    }
+
+    if (message.truncated) {
+        // Long pastes are listed as a preview; fetch the rest only on request.
+        const showAllButton = document.createElement('button');
+        showAllButton.textContent = `Show all (${formatBytes(message.size)})`;
+        showAllButton.classList.add('show-all-button');
+        showAllButton.onclick = async function() {
+            showAllButton.disabled = true;
+            try {
+                const r = await fetch(message.full);
+                if (!r.ok) throw new Error(r.status);
+                message.content = await r.text();
+            } catch (err) {
+                showToast('Failed to load the full text: ' + err.message);
+                showAllButton.disabled = false;
+                return;
+            }
+            message.truncated = false;
+            const raw = messageElement.getAttribute('data-show-raw') === 'true';
+            const newElement = buildTextElement(message.content, raw ? 'plain' : textMode);
+            contentContainer.replaceChild(newElement, contentElementRef);
+            contentElementRef = newElement;
+            contentToCopy = newElement;
+            showAllButton.remove();
+        };
+        buttonsContainer.appendChild(showAllButton);
+    }
+
+    if (textMode !== 'plain') {
+        const showRawButton = document.createElement('button');
+        showRawButton.textContent = 'Show Raw';
+        showRawButton.classList.add('show-raw-button');
+        messageElement.setAttribute('data-show-raw', 'false');
+
+        showRawButton.onclick = function() {
+            const isCurrentlyRaw = (messageElement.getAttribute('data-show-raw') === 'true');
+            const newMode = isCurrentlyRaw ? textMode : 'plain';
+            const newElement = buildTextElement(message.content, newMode);
+            if (message.truncated) {
+                newElement.dataset.full = message.full;
+            }
+            contentContainer.replaceChild(newElement, contentElementRef);
+            contentElementRef = newElement;
+            contentToCopy = newElement;
+            messageElement.setAttribute('data-show-raw', isCurrentlyRaw ? 'false' : 'true');
+            showRawButton.textContent = isCurrentlyRaw ? 'Show Raw' : 'Show Rendered';
+        };
+
+        buttonsContainer.appendChild(showRawButton);
+    }
+
+    messageElement.appendChild(buttonsContainer);
+    return messageElement;
 }
 
 // ===========================================================================
@@ -360,7 +622,7 @@ function copyToClipboard(element) {
 	}
 	if (element.tagName === 'IMG') {
 		if (typeof ClipboardItem !== "undefined") {
-			fetch(element.src)
+			fetch(element.dataset.full || element.src)
 				.then(res => res.blob())
 				.then(blob => {
 					if (blob.type === "image/png") {
@@ -391,12 +653,22 @@ function copyToClipboard(element) {
 					}
 				});
 		} else {
-			navigator.clipboard.writeText(element.src).then(() => {
+			navigator.clipboard.writeText(new URL(element.dataset.full || element.src, location.href).href).then(() => {
 				showToast('Image URL copied to clipboard!');
 			}, (err) => {
 				showToast('Failed to copy image URL: ' + err);
 			});
 		}
+	} else if (element.dataset.full) {
+		// A paste listed only as a preview: copy all of it.
+		fetch(element.dataset.full)
+			.then(r => { if (!r.ok) throw new Error(r.status); return r.text(); })
+			.then(text => navigator.clipboard.writeText(text))
+			.then(() => {
+				showToast('Text copied to clipboard!');
+			}, (err) => {
+				showToast('Failed to copy text: ' + err);
+			});
 	} else if (element.tagName === 'PRE' || element.tagName === 'P') {
 		navigator.clipboard.writeText(element.textContent).then(() => {
 			showToast('Text copied to clipboard!');
@@ -806,5 +1078,5 @@ function renderBoardContext() {
 
 window.onload = function() {
 	applyPermUI();
-	checkForUpdates();
+	pollLoop();
 };
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+'''
+storage.py — index/registry table backends for wpaste.
+
+Every board index and the board registry is a "table": a mapping from a key
+(message id / slug) to a row, with TSVZ's conventions, which the rest of the
+code relies on:
+    read:   table[key] -> [key, col1, col2, ...]   (key INCLUDED at [0])
+    write:  table[key] = [col1, col2, ...]         (trailing columns only)
+    del table[key], key in table, iter(table), len(table), table.items(),
+    table.clear(), table.close()
+    table.delete_many(keys)   del table[key] for each key, in one pass
+plus two hooks used by multi-worker mode:
+    table.flush()    push buffered writes to disk
+    table.reload()   re-read what other processes wrote
+and one for maintenance:
+    table.compact()  rewrite the file without its deleted rows
+
+Backends (INDEX_BACKEND):
+  - 'tsvz'    TSVZTable, the original append-only TSV files. Deletes append a
+              tombstone that older TSVZ versions reload as a blank row.
+  - 'sqlite'  SQLiteTable, one SQLite database (WAL) per table, stored beside
+              the TSV path with a .sqlite3 suffix. Deletes are real deletes.
+              The first open of a table whose .tsv exists but whose database
+              does not imports the .tsv once.
+
+Headers may grow: opening a table with extra trailing columns upgrades the
+file (TSVZ: the header line is rewritten, old rows read '' in the new columns;
+SQLite: the columns are added), so rows written before the change stay valid.
+'''
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:           # Windows: no flock, so multi-worker mode is POSIX-only
+    fcntl = None
+
+import TSVZ
+
+# print with flush on, matching app.py's convention.
+from functools import partial
+print = partial(print, flush=True)
+
+BACKENDS = ('tsvz', 'sqlite')
+
+
+@contextmanager
+def file_lock(path):
+    '''Exclusive advisory lock on `path` (created if missing), held across
+    processes. A no-op where flock is unavailable.'''
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)                  # closing the fd drops the lock
+
+
+class TSVZTable(TSVZ.TSVZed):
+    '''TSVZ.TSVZed with the table hooks. Deletes do not survive a reload on
+    every TSVZ version, hence persistent_deletes = False.
+
+    With `lock_path` (multi-worker mode) the file is shared with other
+    processes, which append to it under file_lock(lock_path). TSVZ's own
+    background rewrite (on load, every rewrite_interval, or on detecting an
+    external change) would rewrite the whole file from this process's copy
+    without that lock and erase their rows. So external changes are not
+    watched for (the shared clocks say when to reload) and every rewrite
+    takes the lock and reloads from the file first.'''
+    persistent_deletes = False
+
+    def __init__(self, path, *, lock_path=None, **kwargs):
+        # Set first: TSVZ's constructor starts the append worker and loads.
+        self.lock_path = lock_path
+        super().__init__(path, **kwargs)
+
+    def checkExternalChanges(self):
+        if self.lock_path is None:
+            return super().checkExternalChanges()
+        return self
+
+    def rewrite(self, force=False, reloadInternalFromFile=None):
+        if self.lock_path is None:
+            return super().rewrite(force=force, reloadInternalFromFile=reloadInternalFromFile)
+        # TSVZ's append worker asks every few ms: only lock when there is work.
+        if not (force or self.deSynced or (self.dirty and self.rewrite_interval
+                and time.time() - os.path.getmtime(self._fileName) >= self.rewrite_interval)):
+            return False
+        with file_lock(self.lock_path):
+            self.externalFileUpdateTime = 0     # always reload: others may have appended
+            return super().rewrite(force=True, reloadInternalFromFile=True)
+
+    def delete_many(self, keys):
+        # Tombstones are queued for TSVZ's appender, which writes them together.
+        for key in keys:
+            del self[key]
+
+    def flush(self):
+        self.commitAppendToFile()
+
+    def compact(self):
+        '''Rewrite the file from memory: tombstone lines go, and so do the
+        blank rows older TSVZ versions reload them as. A shared table must be
+        compacted under its lock, just reloaded (see Boards.compact_registry).'''
+        for key in [k for k, row in self.items() if not any(row[1:])]:
+            OrderedDict.__delitem__(self, key)     # no new tombstone
+        self.commitAppendToFile()
+        self.dirty = True
+        # Straight to TSVZ's rewrite: the caller already holds the lock.
+        TSVZ.TSVZed.rewrite(self, force=True, reloadInternalFromFile=False)
+
+
+class SQLiteTable:
+    '''A TSVZ-shaped mapping over one SQLite table. Rows iterate in insertion
+    order (rowid); overwriting a key keeps its position, as TSVZ does.'''
+    persistent_deletes = True
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = list(header)
+        self._key = self.header[0]
+        self._cols = self.header[1:]
+        # One connection shared by the process's threads, serialized by _lock;
+        # WAL lets other worker processes read while one writes.
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        cols = ', '.join(f'"{c}" TEXT NOT NULL DEFAULT \'\'' for c in self._cols)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('PRAGMA busy_timeout=5000')
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS rows ("{self._key}" TEXT PRIMARY KEY, {cols})')
+            have = {r[1] for r in self._db.execute('PRAGMA table_info(rows)')}
+            for c in self._cols:
+                if c not in have:
+                    self._db.execute(f'ALTER TABLE rows ADD COLUMN "{c}" TEXT NOT NULL DEFAULT \'\'')
+            # Time order comes from each board's in-memory timeline, never from
+            # a query; an index on the (TEXT) unix_time column only cost writes.
+            self._db.execute('DROP INDEX IF EXISTS rows_unix_time')
+        names = ', '.join(f'"{c}"' for c in self.header)
+        self._sql_get = f'SELECT {names} FROM rows WHERE "{self._key}" = ?'
+        self._sql_put = (f'INSERT INTO rows ({names}) VALUES ({", ".join("?" * len(self.header))}) '
+                         f'ON CONFLICT("{self._key}") DO UPDATE SET '
+                         + ', '.join(f'"{c}" = excluded."{c}"' for c in self._cols))
+        self._sql_del = f'DELETE FROM rows WHERE "{self._key}" = ?'
+        self._sql_keys = f'SELECT "{self._key}" FROM rows ORDER BY rowid'
+        self._sql_items = f'SELECT {names} FROM rows ORDER BY rowid'
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def __contains__(self, key):
+        return bool(self._query(self._sql_get, (str(key),)))
+
+    def __getitem__(self, key):
+        rows = self._query(self._sql_get, (str(key),))
+        if not rows:
+            raise KeyError(key)
+        return list(rows[0])
+
+    def get(self, key, default=None):
+        rows = self._query(self._sql_get, (str(key),))
+        return list(rows[0]) if rows else default
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        value = [str(v) if v is not None else '' for v in value]
+        if len(value) == len(self.header) and value[0] == key:
+            value = value[1:]              # tolerate the full row, like TSVZ
+        value = (value + [''] * len(self._cols))[:len(self._cols)]
+        self._query(self._sql_put, [key] + value)
+
+    def __delitem__(self, key):
+        self._query(self._sql_del, (str(key),))
+
+    def delete_many(self, keys):
+        '''One transaction for all of them, not a commit per key.'''
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(self._sql_del, [(str(k),) for k in keys])
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def __iter__(self):
+        return iter([r[0] for r in self._query(self._sql_keys)])
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM rows')[0][0]
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(r[0], list(r)) for r in self._query(self._sql_items)]
+
+    def clear(self):
+        self._query('DELETE FROM rows')
+
+    def flush(self):
+        pass                               # every write is already committed
+
+    def reload(self):
+        pass                               # every read already sees other processes' commits
+
+    def compact(self):
+        pass                               # deletes are real deletes; nothing to drop
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def sqlite_path(path):
+    '''Where the SQLite backend keeps the table that would live at `path`.'''
+    return os.path.splitext(path)[0] + '.sqlite3'
+
+
+def file_header(path):
+    '''The header row a TSVZ file was written with, or None if it has none.'''
+    delimiter = TSVZ.get_delimiter(..., file_name=path)
+    with open(path, encoding='utf8', errors='replace') as fh:
+        line = fh.readline().rstrip('\n')
+    return line.split(delimiter) if line else None
+
+
+def upgrade_tsv_header(path, header):
+    '''Rewrite a TSVZ file whose header is a prefix of `header` (columns were
+    appended since it was written) so it carries the full header; TSVZ would
+    otherwise cut every row back to the old width on reload. Old rows get ''
+    in the new columns; tombstones are dropped. Returns True if rewritten.'''
+    old = file_header(path)
+    if not old or old == list(header) or list(header[:len(old)]) != old:
+        return False
+    rows = TSVZ.readTabularFile(path, header=old, strict=False, verbose=False)
+    root, ext = os.path.splitext(path)
+    tmp = f'{root}.upgrade.{os.getpid()}{ext}'
+    width = len(header)
+    lines = [([str(key)] + [str(v) for v in row[1:]] + [''] * width)[:width]
+             for key, row in rows.items()
+             if key and not str(key).startswith('#') and any(row[1:])]
+    TSVZ.clearTabularFile(tmp, header=header)
+    if lines:
+        TSVZ.appendLinesTabularFile(tmp, lines, header=header, strict=False)
+    os.replace(tmp, path)
+    print(f"Upgraded {path} to columns {list(header)}")
+    return True
+
+
+def migrate_tsv(src, dest, header):
+    '''Import a TSVZ file into a new SQLite table at `dest`; return the row
+    count. Blank (tombstone) rows are dropped. Built under a temporary name
+    and linked into place, so concurrent workers migrate at most once.'''
+    rows = TSVZ.readTabularFile(src, header=file_header(src) or header, strict=False, verbose=False)
+    tmp = f'{dest}.tmp.{os.getpid()}'
+    width = len(header)
+    data = [([str(key)] + [str(v) for v in row[1:]] + [''] * width)[:width]
+            for key, row in rows.items()
+            if key and not str(key).startswith('#') and any(row[1:])]
+    count = len(data)
+    table = SQLiteTable(tmp, header)
+    try:
+        with table._lock:
+            table._db.execute('BEGIN')
+            table._db.executemany(table._sql_put, data)
+            table._db.execute('COMMIT')
+            table._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            table._db.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        table.close()
+    try:
+        os.link(tmp, dest)
+        print(f"Migrated {count} rows from {src} to {dest}")
+    except FileExistsError:
+        count = 0                          # another worker got there first
+    finally:
+        os.unlink(tmp)
+    return count
+
+
+def open_table(path, header, *, backend='tsvz', rewrite_interval=0, lock_path=None):
+    '''Open the table that lives at `path` (a .tsv/.nsv path) with `backend`.
+    `lock_path` marks a table shared by worker processes, whose writers hold
+    file_lock(lock_path); see TSVZTable. SQLite does its own locking.'''
+    if backend == 'tsvz':
+        if os.path.exists(path):
+            upgrade_tsv_header(path, header)
+        return TSVZTable(path, header=header, rewrite_interval=rewrite_interval, verbose=False,
+                         lock_path=lock_path)
+    if backend == 'sqlite':
+        db_path = sqlite_path(path)
+        if not os.path.exists(db_path) and os.path.exists(path):
+            migrate_tsv(path, db_path, header)
+        return SQLiteTable(db_path, header)
+    raise ValueError(f'Unknown index backend {backend!r}; expected one of {BACKENDS}')
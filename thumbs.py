@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+'''
+thumbs.py — background thumbnail and video-poster generation for wpaste.
+
+Listings used to load every image in full. Now, once a message's file is
+saved, a Thumbnailer worker writes a downscaled JPEG beside it:
+    <path>.thumb.jpg
+for images (with Pillow) and, where an `ffmpeg` binary is on PATH, a poster
+frame for videos. /thumb/<id> serves it. An image whose thumbnail is not
+there (not made yet, too small to be worth one, or Pillow missing) is served
+whole instead, so the client can always point <img> at /thumb.
+
+Work goes through a bounded queue drained by `workers` daemon threads, so a
+burst of uploads never makes posting wait; when the queue is full the job is
+dropped and the original keeps being served. A thumbnail is written under a
+temporary name and renamed into place, so it is never seen half-written.
+'''
+import os
+import queue
+import shutil
+import subprocess
+import threading
+try:
+    from PIL import Image, ImageOps
+except ImportError:           # no Pillow: videos only (with ffmpeg), images served whole
+    Image = None
+
+# print with flush on, matching app.py's convention.
+from functools import partial
+print = partial(print, flush=True)
+
+SUFFIX = '.thumb.jpg'
+
+
+class Thumbnailer:
+    '''Makes thumbnails in the background; see the module docstring.'''
+
+    def __init__(self, *, size=480, workers=2, min_bytes=128 * 1024, quality=80, queue_size=1024):
+        self.size = int(size)             # longest side, in pixels
+        self.workers = max(1, int(workers))
+        self.min_bytes = min_bytes        # smaller images are served as they are
+        self.quality = quality
+        self.ffmpeg = shutil.which('ffmpeg')
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.made = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @staticmethod
+    def path_of(path):
+        return f'{path}{SUFFIX}'
+
+    def can(self, msg_type):
+        if msg_type == 'image':
+            return Image is not None
+        if msg_type == 'video':
+            return self.ffmpeg is not None
+        return False
+
+    def submit(self, path, msg_type):
+        '''Queue a thumbnail for the file just saved at `path`.'''
+        if not self.can(msg_type):
+            return
+        try:
+            self._queue.put_nowait((path, msg_type))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def make(self, path, msg_type):
+        '''Write the thumbnail of `path` now; True if one was written.'''
+        try:
+            if msg_type == 'image' and os.path.getsize(path) < self.min_bytes:
+                return False
+        except FileNotFoundError:
+            return False                  # deleted before its turn came
+        dest = self.path_of(path)
+        tmp = f'{dest}.tmp.{threading.get_ident()}'
+        try:
+            if msg_type == 'image':
+                self._image(path, tmp)
+            else:
+                self._poster(path, tmp)
+            os.replace(tmp, dest)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        if not os.path.exists(path):
+            # Deleted while it was being made: the delete removed the
+            # thumbnail before this one was in place, so remove it here.
+            try:
+                os.remove(dest)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _image(self, path, tmp):
+        with Image.open(path) as img:
+            # JPEG can decode straight at a fraction of full size.
+            img.draft('RGB', (self.size, self.size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((self.size, self.size))
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                flat = Image.new('RGB', img.size, (255, 255, 255))
+                flat.paste(img, mask=img.getchannel('A'))
+                img = flat
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(tmp, 'JPEG', quality=self.quality, optimize=True)
+
+    def _poster(self, path, tmp):
+        # `thumbnail` picks a representative frame from the first ones (not a
+        # black first frame); scale keeps the aspect ratio, never upscaling.
+        scale = f"scale='min({self.size},iw)':-2"
+        subprocess.run([self.ffmpeg, '-v', 'error', '-y', '-i', path, '-vf', f'thumbnail,{scale}',
+                        '-frames:v', '1', '-f', 'image2', tmp],
+                       check=True, timeout=120, stdin=subprocess.DEVNULL, capture_output=True)
+
+    def stats(self):
+        with self._lock:
+            return {"images": Image is not None, "videos": self.ffmpeg is not None,
+                    "queued": self._queue.qsize(), "made": self.made,
+                    "failed": self.failed, "dropped": self.dropped}
+
+    def start(self):
+        if not self._threads and (Image is not None or self.ffmpeg):
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'wpaste-thumbs-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while True:
+            path, msg_type = self._queue.get()
+            try:
+                made = self.make(path, msg_type)
+                with self._lock:
+                    self.made += made
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"Thumbnailer: {path}: {e}")
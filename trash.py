@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+'''
+trash.py — background cleanup of soft-deleted files for wpaste.
+
+Deleting a message renames its file to <path>.deleted (see
+delete_file_on_disk in app.py) so it can still be recovered by hand. Trash
+keeps those files in a heap ordered by when they were deleted, and a
+background thread hard-deletes them:
+  - once they are older than `grace` seconds (0 = never by age), and
+  - oldest first while all of them together exceed `budget` bytes
+    (0 = no budget),
+removing at most `rate` files per second so it never competes with uploads
+for the disk.
+
+Files are registered by add() as they are soft-deleted, so no directory walk
+is needed per sweep. The trees under `roots` are walked once, at startup, for
+files left from before a restart (dated by their ctime, which the rename
+sets); after that the heap only changes through add() and the sweep, which
+skips entries whose file went away otherwise. In multi-worker mode each
+worker therefore sweeps what it soft-deleted itself, plus what it found at
+startup.
+
+DiscardQueue is the step before: files whose index rows a batch delete or
+delete_all already dropped, waiting to be soft/hard-deleted by one
+background worker instead of inside the request.
+'''
+import os
+import time
+import heapq
+import queue
+import atexit
+import threading
+
+# print with flush on, matching app.py's convention.
+from functools import partial
+print = partial(print, flush=True)
+
+SUFFIX = '.deleted'
+
+
+class Trash:
+    '''Soft-deleted files awaiting removal; see the module docstring.'''
+
+    def __init__(self, roots, *, grace, budget, rate):
+        self.roots = list(roots)
+        self.grace = grace
+        self.budget = budget
+        self.rate = rate
+        self._heap = []               # (deleted_at, path, size), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.swept = 0
+        self.swept_bytes = 0
+
+    def add(self, path, size, deleted_at=None):
+        '''Register a file just renamed to its .deleted name.'''
+        with self._lock:
+            heapq.heappush(self._heap, (time.time() if deleted_at is None else deleted_at, path, size))
+            self._bytes += size
+            over = self.budget and self._bytes > self.budget
+            first = self._heap[0][1] == path      # the sweeper sleeps past it otherwise
+        if over or first:
+            self._wake.set()
+
+    def discard_under(self, directory):
+        '''Forget the files below `directory` (a board that was removed).'''
+        prefix = os.path.join(os.path.normpath(directory), '')
+        with self._lock:
+            kept = [e for e in self._heap if not os.path.normpath(e[1]).startswith(prefix)]
+            heapq.heapify(kept)
+            self._heap = kept
+            self._bytes = sum(e[2] for e in kept)
+
+    def scan(self):
+        '''Add the files on disk that the heap does not have yet; return how
+        many. The walk runs unlocked, so entries add() pushes meanwhile are
+        merged with what it found rather than replaced by it.'''
+        found = []
+        for root in self.roots:
+            for dirpath, _dirnames, filenames in os.walk(root):
+                for name in filenames:
+                    if name.endswith(SUFFIX):
+                        path = os.path.join(dirpath, name)
+                        try:
+                            st = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        found.append((st.st_ctime, path, st.st_size))
+        with self._lock:
+            known = {e[1] for e in self._heap}
+            new = [e for e in found if e[1] not in known]
+            self._heap.extend(new)
+            heapq.heapify(self._heap)
+            self._bytes += sum(e[2] for e in new)
+        return len(new)
+
+    def _next_due(self, now):
+        '''Pop the oldest entry if it is past grace or over budget.'''
+        with self._lock:
+            if not self._heap:
+                return None
+            deleted_at, path, size = self._heap[0]
+            if (self.grace and deleted_at <= now - self.grace) or (self.budget and self._bytes > self.budget):
+                heapq.heappop(self._heap)
+                self._bytes -= size
+                return path, size
+            return None
+
+    def sweep(self, now=None):
+        '''Remove every file that is due, throttled to `rate` per second;
+        return how many were removed.'''
+        now = time.time() if now is None else now
+        removed = 0
+        while True:
+            entry = self._next_due(now)
+            if entry is None:
+                return removed
+            path, size = entry
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue                  # restored or removed by hand
+            removed += 1
+            with self._lock:
+                self.swept += 1
+                self.swept_bytes += size
+            if self.rate:
+                time.sleep(1.0 / self.rate)
+
+    def _delay(self):
+        '''Seconds until the oldest file passes its grace period.'''
+        with self._lock:
+            if not self._heap or not self.grace:
+                return None
+            return max(0.0, self._heap[0][0] + self.grace - time.time())
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._heap), "bytes": self._bytes, "budget": self.budget,
+                    "swept": self.swept, "swept_bytes": self.swept_bytes}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wpaste-trash-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.scan()                   # leftovers from before a restart
+        except Exception as e:
+            print(f"Trash sweeper: scanning: {e}")
+        while True:
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"Trash: removed {removed} soft-deleted file(s)")
+            except Exception as e:
+                print(f"Trash sweeper: {e}")
+            delay = self._delay()
+            # Nothing due by age: sleep until add() reports the budget exceeded.
+            self._wake.wait(None if delay is None else max(1.0, delay))
+            self._wake.clear()
+
+
+class DiscardQueue:
+    '''Files handed to discard(path, ...) by one background worker, in order;
+    submit() takes a (path, ...) tuple of discard's arguments per file.
+    What is still queued when the process exits is discarded then (atexit),
+    so no file is left behind without its index row.'''
+
+    def __init__(self, discard):
+        self.discard = discard
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+
+    def submit(self, files):
+        for args in files:
+            self._queue.put(args)
+
+    def _discard_next(self, block):
+        '''Discard one queued file; False once the queue is empty.'''
+        try:
+            args = self._queue.get(block=block)
+        except queue.Empty:
+            return False
+        path = args[0]
+        try:
+            self.discard(*args)
+            ok = True
+        except OSError as e:              # e.g. its board was removed meanwhile
+            ok = False
+            print(f"Could not delete {path}: {e}")
+        with self._lock:
+            self.done += ok
+            self.failed += not ok
+        return True
+
+    def drain(self):
+        while self._discard_next(block=False):
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(), "done": self.done, "failed": self.failed}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wpaste-discard', daemon=True)
+            self._thread.start()
+            atexit.register(self.drain)
+
+    def _run(self):
+        while True:
+            self._discard_next(block=True)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+'''
+uploads.py — streaming multipart uploads for wpaste.
+
+Werkzeug's form parser spools every file part into a temporary file and
+FileStorage.save() then copies it to where it belongs, so each upload is
+written to disk twice (and large ones pile up in /tmp first). Here the request
+body is walked with Werkzeug's sans-IO MultipartDecoder instead:
+    iter_parts()  yields the form's parts in order; file parts come out as a
+                  FilePart, an iterator over the part's body chunks.
+    write_part()  writes those chunks straight to their final path, counting
+                  bytes and hashing on the way, after letting the caller look
+                  at the first SNIFF_SIZE bytes to pick (or refuse) that path.
+                  Given a byte budget (what the board's quota has left), it
+                  stops with OverBudget as soon as the part outgrows it, so a
+                  chunked or unsized body cannot slip past the quota.
+
+ChunkedUploads is the resumable alternative for very large files: the file is
+sent as fixed-size chunks, each its own PUT, in any order and retried as often
+as needed, then finished into the board like a normal upload.
+'''
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import secrets
+import threading
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, Field, File
+
+# print with flush on, matching app.py's convention.
+from functools import partial
+print = partial(print, flush=True)
+
+CHUNK_SIZE = 64 * 1024     # bytes read from the request per decoder step
+SNIFF_SIZE = 512           # head of a file part handed to write_part's chooser
+
+
+class OverBudget(Exception):
+    '''More bytes arrived than the budget a write was given; what it had
+    written is removed.'''
+
+    def __init__(self, budget):
+        super().__init__(f'more than the {budget} bytes allowed')
+        self.budget = budget
+
+
+class FilePart:
+    '''One file field of a multipart body. Iterating yields its body in
+    chunks; it must be consumed (or abandoned) before the next part is
+    requested from iter_parts, which skips whatever is left.'''
+
+    def __init__(self, name, filename, headers, chunks):
+        self.name = name
+        self.filename = filename
+        self.content_type = headers.get('content-type', '')
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self._chunks
+
+
+def _part_charset(headers):
+    return parse_options_header(headers.get('content-type', ''))[1].get('charset', 'utf-8')
+
+
+def iter_parts(stream, boundary, *, max_form_memory=None, chunk_size=CHUNK_SIZE):
+    '''Yield (name, value) for every part of the multipart body in `stream`,
+    in the order the client sent them. value is the decoded string for plain
+    fields and a FilePart for file fields. Plain fields are held in memory and
+    capped at max_form_memory bytes (413, as with request.form); file parts
+    are never buffered beyond one chunk.'''
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=max_form_memory)
+
+    def next_event():
+        event = decoder.next_event()
+        while event is NEED_DATA:
+            decoder.receive_data(stream.read(chunk_size) or None)
+            event = decoder.next_event()
+        return event
+
+    def body():
+        # Data events up to and including the one with more_data=False.
+        while True:
+            event = next_event()
+            if not isinstance(event, Data):
+                raise ValueError(f'Unexpected {type(event).__name__} inside a form part')
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                return
+
+    while True:
+        event = next_event()
+        if isinstance(event, Epilogue):
+            return
+        if isinstance(event, Field):
+            chunks, size = [], 0
+            for data in body():
+                size += len(data)
+                if max_form_memory is not None and size > max_form_memory:
+                    raise RequestEntityTooLarge()
+                chunks.append(data)
+            yield event.name, b''.join(chunks).decode(_part_charset(event.headers), 'replace')
+        elif isinstance(event, File):
+            chunks = body()
+            yield event.name, FilePart(event.name, event.filename, event.headers, chunks)
+            for _ in chunks:       # drain what the caller left unread
+                pass
+
+
+def write_part(part, choose_path, budget=None):
+    '''Stream `part` to disk. choose_path(head) is called with the first
+    SNIFF_SIZE bytes (fewer if the part is shorter) and returns the final path
+    to write, or None to refuse the part, which is then skipped. Returns
+    (path, size, sha256 hex digest), or None if refused. A part that fails
+    half-way (client gone, body too large, more than `budget` bytes: then
+    OverBudget) leaves no file behind.'''
+    chunks = iter(part)
+    head = b''
+    for data in chunks:
+        head += data
+        if len(head) >= SNIFF_SIZE:
+            break
+    path = choose_path(head[:SNIFF_SIZE])
+    if path is None:
+        return None
+    digest = hashlib.sha256(head)
+    size = len(head)
+    try:
+        if budget is not None and size > budget:
+            raise OverBudget(budget)
+        with open(path, 'wb') as fh:
+            fh.write(head)
+            for data in chunks:
+                if budget is not None and size + len(data) > budget:
+                    raise OverBudget(budget)
+                fh.write(data)
+                digest.update(data)
+                size += len(data)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return path, size, digest.hexdigest()
+
+
+class ChunkedUploads:
+    '''Resumable uploads kept in `root`, one set of files per upload:
+        <id>.json   what is being uploaded (board, type, filename, size, chunk_size)
+        <id>.part   the file itself, preallocated to its full size
+        <id>.map    one byte per chunk, set once that chunk is on disk
+    All state is on disk, so with MULTI_WORKER any worker can serve any
+    request of an upload. Uploads untouched for `expiry` seconds are removed
+    by sweep(), run periodically from start()'s thread.'''
+
+    ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+    def __init__(self, root, *, chunk_size, max_size, expiry):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.expiry = expiry
+        self._thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        return os.path.join(self.root, f'{upload_id}{suffix}')
+
+    def _chunks(self, meta):
+        return -(-meta['size'] // meta['chunk_size'])
+
+    def create(self, board, msg_type, filename, size):
+        '''Start an upload; returns its metadata (including "id"). Raises
+        ValueError if size is out of range.'''
+        if size < 0 or size > self.max_size:
+            raise ValueError(f'size must be between 0 and {self.max_size} bytes')
+        upload_id = secrets.token_urlsafe(18)
+        meta = {'id': upload_id, 'board': board or '', 'type': msg_type, 'filename': filename,
+                'size': size, 'chunk_size': self.chunk_size, 'created': time.time()}
+        with open(self._path(upload_id, '.part'), 'wb') as fh:
+            fh.truncate(size)
+        with open(self._path(upload_id, '.map'), 'wb') as fh:
+            fh.write(bytes(self._chunks(meta)))
+        # Written last: an upload exists once its .json does.
+        tmp = self._path(upload_id, '.json.tmp')
+        with open(tmp, 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, self._path(upload_id, '.json'))
+        return meta
+
+    def get(self, upload_id):
+        '''The upload's metadata, or None if it does not exist (any more).'''
+        if not self.ID_RE.match(upload_id or ''):
+            return None
+        try:
+            with open(self._path(upload_id, '.json')) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def missing(self, meta):
+        '''Offsets of the chunks not received yet.'''
+        with open(self._path(meta['id'], '.map'), 'rb') as fh:
+            received = fh.read()
+        return [i * meta['chunk_size'] for i, b in enumerate(received) if not b]
+
+    def write_chunk(self, meta, offset, stream, length):
+        '''Write the chunk at `offset`, `length` bytes read from `stream`.
+        Offsets must be chunk-aligned and every chunk but the last exactly
+        chunk_size long; ValueError otherwise. Re-sending a chunk is fine.'''
+        chunk_size, size = meta['chunk_size'], meta['size']
+        if offset < 0 or offset >= size or offset % chunk_size:
+            raise ValueError(f'offset must be a multiple of {chunk_size} below {size}')
+        expected = min(chunk_size, size - offset)
+        if length != expected:
+            raise ValueError(f'chunk at {offset} must be {expected} bytes, got {length}')
+        fd = os.open(self._path(meta['id'], '.part'), os.O_WRONLY)
+        try:
+            pos, end = offset, offset + length
+            while pos < end:
+                data = stream.read(min(CHUNK_SIZE, end - pos))
+                if not data:
+                    raise ValueError(f'chunk at {offset} ended after {pos - offset} of {length} bytes')
+                os.pwrite(fd, data, pos)
+                pos += len(data)
+        finally:
+            os.close(fd)
+        # Only now is the chunk on disk; mark it received.
+        fd = os.open(self._path(meta['id'], '.map'), os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'\x01', offset // chunk_size)
+        finally:
+            os.close(fd)
+
+    def finish(self, meta, choose_path, budget=None):
+        '''Move a complete upload to its final path. choose_path(head) works
+        as for write_part(). Returns the path, or None if refused (the upload
+        is then discarded). Raises ValueError while chunks are missing,
+        OverBudget if the file is larger than `budget` bytes (the quota as it
+        is now, not as it was at create(); the upload is kept, so it can be
+        finished once space is freed) and FileNotFoundError if another
+        request finished it first.'''
+        missing = self.missing(meta)
+        if missing:
+            raise ValueError(f'{len(missing)} chunk(s) missing, first at offset {missing[0]}')
+        if budget is not None and meta['size'] > budget:
+            raise OverBudget(budget)
+        part = self._path(meta['id'], '.part')
+        with open(part, 'rb') as fh:
+            head = fh.read(SNIFF_SIZE)
+        path = choose_path(head)
+        if path is None:
+            self.abort(meta['id'])
+            return None
+        if not os.path.exists(part):
+            raise FileNotFoundError(part)
+        shutil.move(part, path)        # a rename unless root is on another filesystem
+        self.abort(meta['id'])
+        return path
+
+    def abort(self, upload_id):
+        '''Remove whatever is left of an upload.'''
+        for suffix in ('.json', '.part', '.map', '.json.tmp'):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def sweep(self, now=None):
+        '''Remove uploads with no activity for `expiry` seconds; return how many.'''
+        now = time.time() if now is None else now
+        latest = {}
+        for name in os.listdir(self.root):
+            upload_id = name.split('.', 1)[0]
+            try:
+                mtime = os.path.getmtime(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            latest[upload_id] = max(latest.get(upload_id, 0), mtime)
+        stale = [u for u, mtime in latest.items() if now - mtime > self.expiry]
+        for upload_id in stale:
+            self.abort(upload_id)
+        if stale:
+            print(f"Removed {len(stale)} expired partial upload(s)")
+        return len(stale)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wpaste-upload-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Upload sweeper: {e}")
+            time.sleep(max(60, min(self.expiry / 4, 3600)))